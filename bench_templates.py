@@ -0,0 +1,51 @@
+"""Per-render cost of the page templates.
+
+"before" renders the template source through render_template_string, which
+re-parses and recompiles it on every call like the old inline pages did.
+"after" renders the precompiled objects from the TEMPLATES registry.
+
+    python bench_templates.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+os.environ.setdefault("STATE_BACKEND", "file")  # don't create a state db just to benchmark
+
+from flask import render_template, render_template_string
+
+from drive_airtable_email import app, TEMPLATES
+
+RECORD = {"id": "rec123", "fields": {"Size": "35mm", "Stock": ["Portra 400"], "Scan": "Hires", "Comment": "Push +1"}}
+IMAGES = [
+    {"url": f"https://example.com/IMG_{i}.jpg", "thumb_url": f"https://example.com/thumb/IMG_{i}.jpg", "preview_url": None}
+    for i in range(1, 37)
+]
+ORDER = [{"url": image["url"], "size": "10x15", "paper": "Glossy", "border": "No", "price": 0.75} for image in IMAGES]
+
+CONTEXTS = {
+    "password": dict(sticker="1234"),
+    "gallery": dict(sticker="1234", images=IMAGES, zip_url="https://example.com/1234.zip",
+                    current_year=2026, record=RECORD, comment="Push +1"),
+    "order": dict(sticker="1234", images=IMAGES, next_cursor=None, show_whole_roll_buttons=True,
+                  show_select_all_button=False, allow_border_option=True, is_half_frame=False,
+                  roll_label="Whole Roll", price_cap="€15"),
+    "confirm_order": dict(sticker="1234", submitted_order=ORDER, allow_border_option=True, record=RECORD),
+    "review_order": dict(sticker="1234", submitted_order=ORDER, total=15.0, tax=2.6,
+                         type_counter={"10x15 - Glossy": 36}, allow_border=True),
+    "thank_you": dict(sticker="1234", email="client@example.com"),
+}
+
+def main(iterations):
+    print(f"{'template':<15}{'before (µs)':>14}{'after (µs)':>14}{'speedup':>10}")
+    with app.test_request_context():
+        for name, context in CONTEXTS.items():
+            source = app.jinja_loader.get_source(app.jinja_env, f"{name}.html")[0]
+            before = timeit.timeit(lambda: render_template_string(source, **context), number=iterations)
+            after = timeit.timeit(lambda: render_template(TEMPLATES[name], **context), number=iterations)
+            before_us = before / iterations * 1e6
+            after_us = after / iterations * 1e6
+            print(f"{name:<15}{before_us:>14.1f}{after_us:>14.1f}{before_us / after_us:>9.1f}x")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -1,18 +1,34 @@
 import os
 import smtplib
 import requests
+from requests.adapters import HTTPAdapter
 import base64
+import io
 import sys
 import random
 import string
 import time
 import json
-from datetime import datetime
+import re
+import queue
+import sqlite3
+import atexit
+import threading
+import uuid
+import hashlib
+import zipfile
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
 from email.message import EmailMessage
-from flask import Flask, request, render_template_string, session, redirect, url_for
+from flask import Flask, request, render_template, stream_template, session, redirect, url_for, jsonify
 import boto3
 from botocore.client import Config
-from urllib.parse import quote
+from botocore.exceptions import ClientError
+from mollie.api.client import Client as MollieClient
+from mollie.api.error import IdentifierError, NotFoundError
+from urllib.parse import quote, unquote, urlparse
 
 # === Configuration ===
 AIRTABLE_API_KEY = os.getenv("AIRTABLE_API_KEY")
@@ -24,73 +40,411 @@ SMTP_USER = os.getenv("SMTP_USER")
 SMTP_PASS = os.getenv("SMTP_PASS")
 TRIGGER_TOKEN = os.getenv("TRIGGER_TOKEN")
 STATE_FILE = "processed_folders.txt"
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")  # "sqlite" or legacy "file"
+STATE_DB = os.getenv("STATE_DB", "processed_folders.db")
+FULL_SCAN_INTERVAL_HOURS = float(os.getenv("FULL_SCAN_INTERVAL_HOURS", 24))
+FULL_SCAN_SLACK_MINUTES = float(os.getenv("FULL_SCAN_SLACK_MINUTES", 60))  # so a daily trigger reconciles daily
+SCAN_LOOKBACK_DAYS = int(os.getenv("SCAN_LOOKBACK_DAYS", 3))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", os.cpu_count() or 2))
+DERIVATIVE_RETRY_SECONDS = int(os.getenv("DERIVATIVE_RETRY_SECONDS", 3600))
+GALLERY_PAGE_SIZE = int(os.getenv("GALLERY_PAGE_SIZE", 24))
+GALLERY_STREAMING = os.getenv("GALLERY_STREAMING", "1") == "1"
+ZIP_ON_INGEST = os.getenv("ZIP_ON_INGEST", "1") == "1"
+ZIP_PART_SIZE = int(os.getenv("ZIP_PART_SIZE", 16 * 1024 * 1024))
+ZIP_RETRY_SECONDS = int(os.getenv("ZIP_RETRY_SECONDS", 300))
+ZIP_STREAM_CHUNK = int(os.getenv("ZIP_STREAM_CHUNK", 2 * 1024 * 1024))
+ZIP_READ_AHEAD = int(os.getenv("ZIP_READ_AHEAD", 4))
+MANIFEST_CACHE_SIZE = int(os.getenv("MANIFEST_CACHE_SIZE", 500))
+MANIFEST_CACHE_TTL = int(os.getenv("MANIFEST_CACHE_TTL", 300))
+MANIFEST_REFRESH_DAYS = float(os.getenv("MANIFEST_REFRESH_DAYS", 7))  # as long as gallery links work
 S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID")
 S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY")
 S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
 B2_BUCKET_NAME = os.getenv("B2_BUCKET_NAME")
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", 50))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", 5))
+SIGNED_URL_CACHE_SIZE = int(os.getenv("SIGNED_URL_CACHE_SIZE", 5000))
+SIGNED_URL_REFRESH_FRACTION = float(os.getenv("SIGNED_URL_REFRESH_FRACTION", 0.5))
+ROLL_INDEX_REFRESH_SECONDS = int(os.getenv("ROLL_INDEX_REFRESH_SECONDS", 300))
+ROLL_INDEX_MISS_REFRESH_SECONDS = int(os.getenv("ROLL_INDEX_MISS_REFRESH_SECONDS", 30))
+AIRTABLE_CACHE_TTL = int(os.getenv("AIRTABLE_CACHE_TTL", 30))
+AIRTABLE_CACHE_STALE_SECONDS = int(os.getenv("AIRTABLE_CACHE_STALE_SECONDS", 0))
+AIRTABLE_CACHE_SIZE = int(os.getenv("AIRTABLE_CACHE_SIZE", 1000))
+AIRTABLE_RATE_LIMIT = float(os.getenv("AIRTABLE_RATE_LIMIT", 5))
+AIRTABLE_TIMEOUT = float(os.getenv("AIRTABLE_TIMEOUT", 10))
+AIRTABLE_MAX_RETRIES = int(os.getenv("AIRTABLE_MAX_RETRIES", 4))
+SMTP_IDLE_TIMEOUT = int(os.getenv("SMTP_IDLE_TIMEOUT", 60))
+TRIGGER_CONCURRENCY = int(os.getenv("TRIGGER_CONCURRENCY", 4))
+MAIL_WORKERS = int(os.getenv("MAIL_WORKERS", TRIGGER_CONCURRENCY))
+MAIL_MAX_RETRIES = int(os.getenv("MAIL_MAX_RETRIES", 3))
+EMAIL_SENT_FLUSH_SECONDS = float(os.getenv("EMAIL_SENT_FLUSH_SECONDS", 2))
+TRIGGER_JOB_HISTORY = int(os.getenv("TRIGGER_JOB_HISTORY", 20))
+MOLLIE_API_KEY = os.getenv("MOLLIE_API_KEY")
+PAYMENT_GATEWAY = os.getenv("PAYMENT_GATEWAY", "mollie")  # "mollie" or "fake" for offline runs
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 2))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", 24))
+WEBHOOK_RETRY_SECONDS = int(os.getenv("WEBHOOK_RETRY_SECONDS", 30))
+WEBHOOK_SWEEP_SECONDS = int(os.getenv("WEBHOOK_SWEEP_SECONDS", 60))
+WEBHOOK_STALE_SECONDS = int(os.getenv("WEBHOOK_STALE_SECONDS", 900))
+
+LOGO_URL = "https://cdn.sumup.store/shops/06666267/settings/th480/b23c5cae-b59a-41f7-a55e-1b145f750153.png"
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY") or "fallback-secret"
 
+# === Templates ===
+# Pages live in templates/ on top of a shared base.html. They're compiled once
+# here and rendered from the compiled objects on every request.
+TEMPLATE_NAMES = ("password", "gallery", "order", "confirm_order", "review_order", "thank_you")
+app.jinja_env.globals["logo_url"] = LOGO_URL
+TEMPLATES = {name: app.jinja_env.get_template(f"{name}.html") for name in TEMPLATE_NAMES}
+
+# === S3-Compatible Client ===
+# boto3 clients are thread-safe once built, so one pooled client is shared by
+# every Flask worker thread instead of paying endpoint/credential resolution
+# on each call. Sessions are not thread-safe, hence the lock around creation.
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = boto3.session.Session().client(
+                    's3',
+                    aws_access_key_id=S3_ACCESS_KEY_ID,
+                    aws_secret_access_key=S3_SECRET_ACCESS_KEY,
+                    endpoint_url=S3_ENDPOINT_URL,
+                    config=Config(
+                        signature_version='s3v4',
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        tcp_keepalive=True,
+                        connect_timeout=5,
+                        read_timeout=60,
+                        retries={'max_attempts': S3_MAX_ATTEMPTS, 'mode': 'standard'}
+                    )
+                )
+    return _s3_client
+
+# === Signed URL Cache ===
+# A presigned URL is reused until `refresh_fraction` of its lifetime has
+# passed, so a reused link always has at least the remaining fraction of
+# `expires_in` left when it reaches the customer.
+class SignedUrlCache:
+    def __init__(self, max_size=SIGNED_URL_CACHE_SIZE, refresh_fraction=SIGNED_URL_REFRESH_FRACTION):
+        self.max_size = max_size
+        self.refresh_fraction = refresh_fraction
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, bucket, key, expires_in):
+        cache_key = (bucket, key, expires_in)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry and now - entry[1] < expires_in * self.refresh_fraction:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        return None
+
+    def put(self, bucket, key, expires_in, url):
+        cache_key = (bucket, key, expires_in)
+        with self._lock:
+            self._entries[cache_key] = (url, time.time())
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+signed_url_cache = SignedUrlCache()
+
 # === S3-Compatible Signed URL ===
 def generate_signed_url(file_path, expires_in=604800):
-    s3 = boto3.client(
-        's3',
-        aws_access_key_id=S3_ACCESS_KEY_ID,
-        aws_secret_access_key=S3_SECRET_ACCESS_KEY,
-        endpoint_url=S3_ENDPOINT_URL,
-        config=Config(signature_version='s3v4')
-    )
-    return s3.generate_presigned_url(
+    url = signed_url_cache.get(B2_BUCKET_NAME, file_path, expires_in)
+    if url:
+        return url
+    s3 = get_s3_client()
+    url = s3.generate_presigned_url(
         'get_object',
         Params={'Bucket': B2_BUCKET_NAME, 'Key': file_path},
         ExpiresIn=expires_in
     )
+    signed_url_cache.put(B2_BUCKET_NAME, file_path, expires_in, url)
+    return url
 
 def log(message):
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     print(f"[{timestamp}] {message}", flush=True)
 
+# === Airtable Record Cache ===
+# Read-through cache for find_airtable_record, keyed by Twin Sticker. With
+# AIRTABLE_CACHE_STALE_SECONDS > 0 an expired entry is still served for that
+# long while a background thread fetches a fresh copy.
+class AirtableRecordCache:
+    def __init__(self, ttl=AIRTABLE_CACHE_TTL, stale_seconds=AIRTABLE_CACHE_STALE_SECONDS, max_size=AIRTABLE_CACHE_SIZE):
+        self.ttl = ttl
+        self.stale_seconds = stale_seconds
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, sticker):
+        with self._lock:
+            entry = self._entries.get(sticker)
+            if not entry:
+                return None, None
+            record, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < self.ttl:
+                return record, "fresh"
+            if age < self.ttl + self.stale_seconds:
+                return record, "stale"
+            del self._entries[sticker]
+            return None, None
+
+    def put(self, sticker, record):
+        with self._lock:
+            self._entries[sticker] = (record, time.monotonic())
+            self._entries.move_to_end(sticker)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def put_record(self, record):
+        # Refresh every cached sticker pointing at this record, plus the
+        # record's own Twin Sticker value.
+        stickers = {str(record["fields"].get("Twin Sticker", ""))} - {""}
+        with self._lock:
+            stickers.update(k for k, (cached, _) in self._entries.items() if cached["id"] == record["id"])
+        for sticker in stickers:
+            self.put(sticker, record)
+
+    def invalidate_record(self, record_id):
+        with self._lock:
+            for sticker in [k for k, (cached, _) in self._entries.items() if cached["id"] == record_id]:
+                del self._entries[sticker]
+
+    def claim_refresh(self, sticker):
+        with self._lock:
+            if sticker in self._refreshing:
+                return False
+            self._refreshing.add(sticker)
+            return True
+
+    def release_refresh(self, sticker):
+        with self._lock:
+            self._refreshing.discard(sticker)
+
+airtable_record_cache = AirtableRecordCache()
+
+# === Airtable Client ===
+# Airtable allows 5 requests/second per base and answers 429 beyond that, so
+# every call goes through one shared session paced by a token bucket.
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Reserve a token even if we have to wait for it, so callers are
+            # served in the order they arrived.
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+class AirtableClient:
+    def __init__(self, api_key, base_id, table_name, rate=AIRTABLE_RATE_LIMIT, timeout=AIRTABLE_TIMEOUT, max_retries=AIRTABLE_MAX_RETRIES):
+        self.table_url = f"https://api.airtable.com/v0/{base_id}/{table_name}"
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.limiter = TokenBucket(rate)
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=16))
+        self.session.headers.update({"Authorization": f"Bearer {api_key}"})
+
+    def request(self, method, record_id=None, **kwargs):
+        url = f"{self.table_url}/{record_id}" if record_id else self.table_url
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                log(f"⚠️ Airtable {method} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            if (response.status_code == 429 or response.status_code >= 500) and attempt < self.max_retries:
+                delay = self._retry_after(response) or self._backoff(attempt)
+                log(f"⚠️ Airtable {method} returned {response.status_code}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            return response
+
+    def get(self, record_id=None, **kwargs):
+        return self.request("GET", record_id, **kwargs)
+
+    def patch(self, record_id=None, **kwargs):
+        return self.request("PATCH", record_id, **kwargs)
+
+    @staticmethod
+    def _retry_after(response):
+        try:
+            return float(response.headers.get("Retry-After", ""))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _backoff(attempt):
+        return min(30.0, 2 ** attempt) + random.uniform(0, 0.5)
+
+airtable = AirtableClient(AIRTABLE_API_KEY, AIRTABLE_BASE_ID, AIRTABLE_TABLE_NAME)
+
 # === Airtable ===
 def update_airtable_record(record_id, fields):
-    url = f"https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_TABLE_NAME}/{record_id}"
-    headers = {
-        "Authorization": f"Bearer {AIRTABLE_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    response = requests.patch(url, headers=headers, json={"fields": fields})
+    response = airtable.patch(record_id, json={"fields": fields})
     if response.status_code == 200:
+        airtable_record_cache.put_record(response.json())
         log(f"✅ Airtable updated: {fields}")
-    else:
-        log(f"❌ Failed to update Airtable record {record_id}: {response.text}")
+        return True
+    airtable_record_cache.invalidate_record(record_id)
+    log(f"❌ Failed to update Airtable record {record_id}: {response.text}")
+    return False
 
-def find_airtable_record(twin_sticker):
-    url = f"https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_TABLE_NAME}"
-    headers = {"Authorization": f"Bearer {AIRTABLE_API_KEY}"}
+def fetch_airtable_record(twin_sticker):
     formula = f"{{Twin Sticker}}='{twin_sticker}'"
-    response = requests.get(url, headers=headers, params={"filterByFormula": formula})
+    response = airtable.get(params={"filterByFormula": formula})
     if response.status_code != 200:
         log(f"❌ Airtable API error: {response.status_code}")
         return None
     records = response.json().get("records", [])
+    if records:
+        airtable_record_cache.put(str(twin_sticker), records[0])
     return records[0] if records else None
 
+def _revalidate_airtable_record(twin_sticker):
+    try:
+        fetch_airtable_record(twin_sticker)
+    except Exception as e:
+        log(f"❌ Airtable revalidation failed for {twin_sticker}: {e}")
+    finally:
+        airtable_record_cache.release_refresh(twin_sticker)
+
+def find_airtable_record(twin_sticker):
+    key = str(twin_sticker)
+    record, state = airtable_record_cache.get(key)
+    if state == "fresh":
+        return record
+    if state == "stale":
+        if airtable_record_cache.claim_refresh(key):
+            threading.Thread(target=_revalidate_airtable_record, args=(key,), daemon=True).start()
+        return record
+    return fetch_airtable_record(key)
+
+# === Airtable: Batch access for /trigger ===
+AIRTABLE_BATCH_SIZE = 10  # Airtable caps multi-record PATCH at 10 records
+AIRTABLE_LOOKUP_CHUNK = 50  # stickers per OR() formula, to keep the URL short
+
+def fetch_unsent_airtable_records():
+    # One paginated query for every roll that still needs its email, mapped
+    # by normalized sticker. Returns None if Airtable can't be reached so the
+    # caller can fall back to per-roll lookups.
+    params = {"filterByFormula": "NOT({Email Sent})"}
+    records = {}
+    while True:
+        try:
+            response = airtable.get(params=params)
+        except requests.RequestException as e:
+            log(f"❌ Airtable bulk fetch failed: {e}")
+            return None
+        if response.status_code != 200:
+            log(f"❌ Airtable bulk fetch failed: {response.status_code}")
+            return None
+        data = response.json()
+        for record in data.get("records", []):
+            sticker = str(record['fields'].get('Twin Sticker', ''))
+            if not sticker:
+                continue
+            records.setdefault(sticker_key(sticker), record)
+            airtable_record_cache.put(sticker, record)
+        if not data.get("offset"):
+            break
+        params["offset"] = data["offset"]
+    log(f"📥 Prefetched {len(records)} unsent Airtable records")
+    return records
+
+def fetch_airtable_records_by_sticker(stickers):
+    # Records for the given stickers, whatever their Email Sent, with one
+    # filtered query per chunk instead of a GET each. Mapped by normalized
+    # sticker; None if Airtable can't be reached.
+    records = {}
+    stickers = sorted(set(stickers))
+    for i in range(0, len(stickers), AIRTABLE_LOOKUP_CHUNK):
+        chunk = stickers[i:i + AIRTABLE_LOOKUP_CHUNK]
+        params = {"filterByFormula": "OR(" + ",".join(f"{{Twin Sticker}}='{sticker}'" for sticker in chunk) + ")"}
+        while True:
+            try:
+                response = airtable.get(params=params)
+            except requests.RequestException as e:
+                log(f"❌ Airtable sticker lookup failed: {e}")
+                return None
+            if response.status_code != 200:
+                log(f"❌ Airtable sticker lookup failed: {response.status_code}")
+                return None
+            data = response.json()
+            for record in data.get("records", []):
+                sticker = str(record['fields'].get('Twin Sticker', ''))
+                if sticker:
+                    records.setdefault(sticker_key(sticker), record)
+                    airtable_record_cache.put(sticker, record)
+            if not data.get("offset"):
+                break
+            params["offset"] = data["offset"]
+    return records
+
+def update_airtable_records(updates):
+    # updates: list of (record_id, fields). Returns the ids that were saved.
+    saved = set()
+    for i in range(0, len(updates), AIRTABLE_BATCH_SIZE):
+        chunk = updates[i:i + AIRTABLE_BATCH_SIZE]
+        payload = {"records": [{"id": record_id, "fields": fields} for record_id, fields in chunk]}
+        response = airtable.patch(json=payload)
+        if response.status_code == 200:
+            for record in response.json().get("records", []):
+                airtable_record_cache.put_record(record)
+                saved.add(record["id"])
+            log(f"✅ Airtable batch updated: {len(chunk)} records")
+        else:
+            for record_id, _ in chunk:
+                airtable_record_cache.invalidate_record(record_id)
+            log(f"❌ Failed to batch update Airtable records: {response.text}")
+    return saved
+
 # === Airtable: Store print order in existing Rolls table ===
 def store_print_order_in_roll(sticker, submitted_order, mollie_id):
-    url = f"https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_TABLE_NAME}"
-    headers = {
-        "Authorization": f"Bearer {AIRTABLE_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    formula = f"{{Twin Sticker}}='{sticker}'"
-    response = requests.get(url, headers=headers, params={"filterByFormula": formula})
-    records = response.json().get("records", [])
-    if not records:
+    record = find_airtable_record(sticker)
+    if not record:
         log(f"❌ No matching roll found for sticker {sticker}")
         return
 
-    roll_id = records[0]["id"]
-    patch_url = f"{url}/{roll_id}"
+    roll_id = record["id"]
     patch_data = {
         "fields": {
             "Print Order JSON": json.dumps(submitted_order),
@@ -98,12 +452,127 @@ def store_print_order_in_roll(sticker, submitted_order, mollie_id):
             "Print Order Paid": False
         }
     }
-    patch_response = requests.patch(patch_url, headers=headers, json=patch_data)
+    patch_response = airtable.patch(roll_id, json=patch_data)
     if patch_response.status_code == 200:
+        airtable_record_cache.put_record(patch_response.json())
         log("✅ Print order saved to Rolls table.")
     else:
+        airtable_record_cache.invalidate_record(roll_id)
         log(f"❌ Failed to update Rolls record: {patch_response.text}")
 
+# === Mail Queue ===
+# One authenticated SMTP connection per worker thread, reused across messages
+# and closed after SMTP_IDLE_TIMEOUT seconds without traffic. Callers enqueue
+# a message and get a MailJob back; they only wait on it if they care about
+# the outcome.
+class SMTPConnection:
+    def __init__(self, idle_timeout=SMTP_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._server = None
+        self._last_used = 0.0
+
+    def send(self, msg):
+        if self._server is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self.close()
+        if self._server is None:
+            self._connect()
+        try:
+            self._server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped an idle connection; one fresh login is free.
+            self.close()
+            self._connect()
+            self._server.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def _connect(self):
+        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=30)
+        server.starttls()
+        server.login(SMTP_USER, SMTP_PASS)
+        self._server = server
+
+    def close(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            pass
+        self._server = None
+
+class MailJob:
+    def __init__(self, msg):
+        self.msg = msg
+        self.ok = None
+        self.error = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.ok
+
+class MailQueue:
+    def __init__(self, workers=MAIL_WORKERS, max_retries=MAIL_MAX_RETRIES):
+        self.workers = workers
+        self.max_retries = max_retries
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def enqueue(self, msg):
+        self.start()
+        job = MailJob(msg)
+        self._queue.put(job)
+        log(f"✉️ Queued email to {msg['To']}: {msg['Subject']}")
+        return job
+
+    def start(self):
+        if self._threads:
+            return
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f"mail-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def drain(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+    def _run(self):
+        connection = SMTPConnection()
+        while True:
+            try:
+                job = self._queue.get(timeout=connection.idle_timeout)
+            except queue.Empty:
+                connection.close()
+                continue
+            try:
+                self._deliver(connection, job)
+            finally:
+                job._done.set()
+                self._queue.task_done()
+
+    def _deliver(self, connection, job):
+        for attempt in range(self.max_retries + 1):
+            try:
+                connection.send(job.msg)
+                job.ok = True
+                log(f"✅ Email sent successfully to {job.msg['To']}.")
+                return
+            except Exception as e:
+                connection.close()
+                job.error = e
+                if attempt < self.max_retries:
+                    log(f"⚠️ Email to {job.msg['To']} failed ({e}), retrying")
+                    time.sleep(2 ** attempt)
+        job.ok = False
+        log(f"❌ Email failed: {job.error}")
+
+mail_queue = MailQueue()
+atexit.register(mail_queue.drain)
+
 # === Email ===
 def generate_password(length=8):
     return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
@@ -126,7 +595,7 @@ def send_email(to_address, subject, body):
       <div style="width:100%;text-align:center;padding:40px 20px;">
         <div style="display:inline-block;text-align:left;max-width:600px;width:100%;">
           <div style="text-align:center;">
-            <img src="https://cdn.sumup.store/shops/06666267/settings/th480/b23c5cae-b59a-41f7-a55e-1b145f750153.png" alt="Logo" style="width:250px;margin-bottom:20px;">
+            <img src="{LOGO_URL}" alt="Logo" style="width:250px;margin-bottom:20px;">
           </div>
           <div style="font-size:16px;color:#333;line-height:1.5;">
             {body_html}
@@ -138,72 +607,1228 @@ def send_email(to_address, subject, body):
     """
     msg.add_alternative(html_body, subtype='html')
 
-    try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASS)
-            server.send_message(msg)
-        log("✅ Email sent successfully.")
-    except Exception as e:
-        log(f"❌ Email failed: {e}")
+    return mail_queue.enqueue(msg)
+
+# === Processed State ===
+# Per-folder status for /trigger: "listed" when a new folder is first seen,
+# "emailed" once the customer has their link, "failed" when a step broke and
+# the next run should retry. Only "emailed" counts as processed.
+# The same store keeps the Mollie webhook ledger: one row per (payment id,
+# payment status), "processing" while its side effects run, then "done" or
+# "failed". A "done" row turns repeat deliveries into no-ops.
+# Webhooks themselves are recorded as soon as they arrive, since Mollie gets
+# its 200 before any work is done: "queued", "processing" while a worker has
+# it, "failed" with the time of the next attempt (none once it's given up).
+# Rows are dropped when handled. due_webhooks() is what still has to run.
+class FileStateStore:
+    # Legacy append-only text file; it can only remember emailed folders.
+    def __init__(self, path=STATE_FILE):
+        self.path = path
+        self._folders = None
+        self._payments = {}  # (payment id, status) -> (state, updated at)
+        self._webhooks = {}  # payment id -> [state, attempts, next attempt, updated at]
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._folders is None:
+            self._folders = set(open(self.path).read().splitlines()) if os.path.exists(self.path) else set()
+        return self._folders
+
+    def is_processed(self, folder):
+        with self._lock:
+            return folder in self._load()
+
+    def get(self, folder):
+        return {"name": folder, "status": "emailed"} if self.is_processed(folder) else None
+
+    def set_status(self, folder, status, error=None, stamp=True):
+        if status != "emailed":
+            return
+        with self._lock:
+            folders = self._load()
+            if folder in folders:
+                return
+            with open(self.path, "a") as f:
+                f.write(folder + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            folders.add(folder)
+
+    # The text file has no room for a scan cursor, retry list or send times,
+    # so the legacy backend always runs full scans and never refreshes rolls.
+    def get_meta(self, key):
+        return None
 
-# === Folder Utilities ===
-def load_processed():
-    return set(open(STATE_FILE).read().splitlines()) if os.path.exists(STATE_FILE) else set()
+    def set_meta(self, key, value):
+        pass
+
+    def unprocessed_folders(self):
+        return []
+
+    def emailed_since(self, since):
+        return []
+
+    # Nowhere to persist the webhook ledger either; it lives in memory, so
+    # duplicate deliveries are only caught until the process restarts.
+    def claim_payment(self, payment_id, status):
+        with self._lock:
+            state, updated = self._payments.get((payment_id, status), (None, 0.0))
+            if state == "done" or (state == "processing" and time.time() - updated < WEBHOOK_STALE_SECONDS):
+                return False
+            self._payments[(payment_id, status)] = ("processing", time.time())
+            return True
+
+    def finish_payment(self, payment_id, status, error=None):
+        with self._lock:
+            self._payments[(payment_id, status)] = ("failed" if error else "done", time.time())
+
+    def payment_done(self, payment_id, status):
+        with self._lock:
+            return self._payments.get((payment_id, status), (None,))[0] == "done"
+
+    def queue_webhook(self, payment_id):
+        with self._lock:
+            self._webhooks[payment_id] = ["queued", 0, None, time.time()]
+
+    def start_webhook(self, payment_id):
+        with self._lock:
+            webhook = self._webhooks.setdefault(payment_id, ["queued", 0, None, time.time()])
+            webhook[0], webhook[1], webhook[3] = "processing", webhook[1] + 1, time.time()
+            return webhook[1]
+
+    def finish_webhook(self, payment_id, error=None, retry_at=None):
+        with self._lock:
+            webhook = self._webhooks.get(payment_id)
+            if webhook is None or webhook[0] != "processing":
+                return
+            if error is None:
+                del self._webhooks[payment_id]
+            else:
+                # retry_at is naive UTC like every timestamp in the stores;
+                # .timestamp() alone would read it as local time.
+                next_attempt = retry_at.replace(tzinfo=timezone.utc).timestamp() if retry_at else None
+                webhook[0], webhook[2], webhook[3] = "failed", next_attempt, time.time()
+
+    def due_webhooks(self):
+        now = time.time()
+        with self._lock:
+            return [payment_id for payment_id, (state, _, next_attempt, updated) in self._webhooks.items()
+                    if state == "queued"
+                    or (state == "failed" and next_attempt is not None and next_attempt <= now)
+                    or (state == "processing" and now - updated > WEBHOOK_STALE_SECONDS)]
+
+class SQLiteStateStore:
+    def __init__(self, path=STATE_DB, legacy_file=STATE_FILE):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS folders (
+                    name TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    listed_at TEXT,
+                    emailed_at TEXT,
+                    failed_at TEXT,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS payments (
+                    payment_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (payment_id, status)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS webhooks (
+                    payment_id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at TEXT,
+                    received_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+        self._import_legacy(legacy_file)
+
+    def _connect(self):
+        # sqlite3 connections can't be shared across threads; keep one each.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _import_legacy(self, legacy_file):
+        conn = self._connect()
+        imported = conn.execute("SELECT value FROM meta WHERE key = 'legacy_imported'").fetchone()
+        if imported:
+            # Older imports stamped emailed_at with the import time, which made
+            # the whole archive look freshly emailed to the refresh phase.
+            with conn:
+                conn.execute(
+                    "UPDATE folders SET emailed_at = NULL WHERE emailed_at = ? AND listed_at IS NULL",
+                    (imported[0],)
+                )
+            return
+        folders = open(legacy_file).read().splitlines() if os.path.exists(legacy_file) else []
+        now = datetime.utcnow().isoformat()
+        with conn:
+            # We don't know when these were emailed; leave emailed_at empty so
+            # they stay out of emailed_since().
+            conn.executemany(
+                "INSERT OR IGNORE INTO folders (name, status, updated_at) VALUES (?, 'emailed', ?)",
+                [(folder, now) for folder in folders if folder]
+            )
+            conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_imported', ?)", (now,))
+        if folders:
+            log(f"📦 Imported {len(folders)} folders from {legacy_file}")
+
+    def is_processed(self, folder):
+        row = self._connect().execute("SELECT status FROM folders WHERE name = ?", (folder,)).fetchone()
+        return bool(row) and row[0] == "emailed"
+
+    def set_status(self, folder, status, error=None, stamp=True):
+        # stamp=False leaves <status>_at alone, for a status reached at some
+        # unknown time (a roll found already emailed in Airtable).
+        now = datetime.utcnow().isoformat()
+        column = f"{status}_at"
+        if column not in ("listed_at", "emailed_at", "failed_at"):
+            raise ValueError(f"Unknown folder status: {status}")
+        with self._connect() as conn:
+            conn.execute(
+                f"""
+                INSERT INTO folders (name, status, error, {column}, updated_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    status = excluded.status, error = excluded.error,
+                    {column} = COALESCE(excluded.{column}, {column}), updated_at = excluded.updated_at
+                """,
+                (folder, status, error, now if stamp else None, now)
+            )
+
+    def unprocessed_folders(self):
+        rows = self._connect().execute("SELECT name FROM folders WHERE status != 'emailed' ORDER BY name").fetchall()
+        return [row[0] for row in rows]
+
+    def emailed_since(self, since):
+        rows = self._connect().execute(
+            "SELECT name FROM folders WHERE status = 'emailed' AND emailed_at >= ? ORDER BY name", (since.isoformat(),)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_meta(self, key):
+        row = self._connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def get(self, folder):
+        row = self._connect().execute(
+            "SELECT name, status, error, listed_at, emailed_at, failed_at, updated_at FROM folders WHERE name = ?",
+            (folder,)
+        ).fetchone()
+        if not row:
+            return None
+        return dict(zip(("name", "status", "error", "listed_at", "emailed_at", "failed_at", "updated_at"), row))
+
+    def claim_payment(self, payment_id, status):
+        # True if the caller should run this payment's side effects: never
+        # seen, failed before, or left "processing" by a worker that died.
+        now = datetime.utcnow()
+        stale = (now - timedelta(seconds=WEBHOOK_STALE_SECONDS)).isoformat()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """
+                INSERT INTO payments (payment_id, status, state, attempts, created_at, updated_at)
+                VALUES (?, ?, 'processing', 1, ?, ?)
+                ON CONFLICT(payment_id, status) DO UPDATE SET
+                    state = 'processing', error = NULL, attempts = attempts + 1, updated_at = excluded.updated_at
+                WHERE state = 'failed' OR (state = 'processing' AND updated_at < ?)
+                """,
+                (payment_id, status, now.isoformat(), now.isoformat(), stale)
+            )
+            return cursor.rowcount > 0
+
+    def finish_payment(self, payment_id, status, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE payments SET state = ?, error = ?, updated_at = ? WHERE payment_id = ? AND status = ?",
+                ("failed" if error else "done", error, datetime.utcnow().isoformat(), payment_id, status)
+            )
+
+    def payment_done(self, payment_id, status):
+        row = self._connect().execute(
+            "SELECT state FROM payments WHERE payment_id = ? AND status = ?", (payment_id, status)
+        ).fetchone()
+        return bool(row) and row[0] == "done"
+
+    def queue_webhook(self, payment_id):
+        # A new delivery starts the retry schedule over: the payment may
+        # have moved on to a status whose side effects can succeed.
+        now = datetime.utcnow().isoformat()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO webhooks (payment_id, state, attempts, next_attempt_at, received_at, updated_at)
+                VALUES (?, 'queued', 0, ?, ?, ?)
+                ON CONFLICT(payment_id) DO UPDATE SET
+                    state = 'queued', error = NULL, attempts = 0,
+                    next_attempt_at = excluded.next_attempt_at, updated_at = excluded.updated_at
+                """,
+                (payment_id, now, now, now)
+            )
+
+    def start_webhook(self, payment_id):
+        # Returns the attempt number.
+        now = datetime.utcnow().isoformat()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO webhooks (payment_id, state, attempts, received_at, updated_at)
+                VALUES (?, 'processing', 1, ?, ?)
+                ON CONFLICT(payment_id) DO UPDATE SET
+                    state = 'processing', attempts = attempts + 1, updated_at = excluded.updated_at
+                """,
+                (payment_id, now, now)
+            )
+            return conn.execute("SELECT attempts FROM webhooks WHERE payment_id = ?", (payment_id,)).fetchone()[0]
+
+    def finish_webhook(self, payment_id, error=None, retry_at=None):
+        # Only touches a row still "processing": one queued again by a new
+        # delivery in the meantime stays due.
+        with self._connect() as conn:
+            if error is None:
+                conn.execute("DELETE FROM webhooks WHERE payment_id = ? AND state = 'processing'", (payment_id,))
+                return
+            conn.execute(
+                """
+                UPDATE webhooks SET state = 'failed', error = ?, next_attempt_at = ?, updated_at = ?
+                WHERE payment_id = ? AND state = 'processing'
+                """,
+                (error, retry_at.isoformat() if retry_at else None, datetime.utcnow().isoformat(), payment_id)
+            )
+
+    def due_webhooks(self):
+        now = datetime.utcnow()
+        stale = (now - timedelta(seconds=WEBHOOK_STALE_SECONDS)).isoformat()
+        rows = self._connect().execute(
+            """
+            SELECT payment_id FROM webhooks
+            WHERE state = 'queued'
+               OR (state = 'failed' AND next_attempt_at <= ?)
+               OR (state = 'processing' AND updated_at < ?)
+            ORDER BY received_at
+            """,
+            (now.isoformat(), stale)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+def create_state_store():
+    if STATE_BACKEND == "file":
+        return FileStateStore()
+    return SQLiteStateStore()
+
+state_store = create_state_store()
 
 def save_processed(folder_name):
-    with open(STATE_FILE, "a") as f:
-        f.write(folder_name + "\n")
-
-def list_roll_folders(prefix="rolls/"):
-    s3 = boto3.client(
-        's3',
-        aws_access_key_id=S3_ACCESS_KEY_ID,
-        aws_secret_access_key=S3_SECRET_ACCESS_KEY,
-        endpoint_url=S3_ENDPOINT_URL,
-        config=Config(signature_version='s3v4')
-    )
-    result = s3.list_objects_v2(Bucket=B2_BUCKET_NAME, Prefix=prefix)
-    folders = set()
-    for obj in result.get("Contents", []):
-        parts = obj["Key"].split("/")
-        if len(parts) >= 2:
-            folders.add(parts[1])
-    return sorted(folders)
+    state_store.set_status(folder_name, "emailed")
 
-# === Main ===
-def main():
-    log("🚀 Script triggered.")
-    processed = load_processed()
-    folders = list_roll_folders()
+# === Folder Utilities ===
+# Roll folders are named "<scan date>_<zero-padded sticker>", the date as
+# YYYYMMDD or YYYY-MM-DD (one style per bucket), so names sort by date.
+# Incremental scans rely on that: they list from a few days before the newest
+# folder's date. Folders that don't start with a date are only picked up
+# reliably by full scans, and new ones are logged.
+ROLL_FOLDER_DATE_RE = re.compile(r"^(\d{4})(-?)(\d{2})-?(\d{2})_")
+
+def scan_start_after(cursor):
+    # The StartAfter bound for an incremental scan: SCAN_LOOKBACK_DAYS before
+    # the cursor folder's date, in the same style, so folders uploaded late
+    # or sorting below the cursor on the same day are still listed.
+    match = ROLL_FOLDER_DATE_RE.match(cursor or "")
+    if not match:
+        return cursor
+    year, separator, month, day = match.groups()
+    try:
+        start = datetime(int(year), int(month), int(day)) - timedelta(days=SCAN_LOOKBACK_DAYS)
+    except ValueError:
+        return cursor
+    return start.strftime(f"%Y{separator}%m{separator}%d")
+
+def list_roll_folders(prefix="rolls/", start_after=None):
+    # Yields folder names one page at a time. With Delimiter='/' the listing
+    # returns one CommonPrefix per folder instead of every scan key, already
+    # in lexicographic order. start_after skips every folder up to and
+    # including that one; it may also be a bare date, which keeps that day.
+    s3 = get_s3_client()
+    paginator = s3.get_paginator('list_objects_v2')
+    params = {"Bucket": B2_BUCKET_NAME, "Prefix": prefix, "Delimiter": '/'}
+    if start_after:
+        # Sorts after every key inside the start_after folder.
+        params["StartAfter"] = f"{prefix}{start_after}/\U0010ffff"
+    for page in paginator.paginate(**params):
+        for common_prefix in page.get("CommonPrefixes", []):
+            name = common_prefix["Prefix"][len(prefix):].rstrip("/")
+            if name:
+                yield name
+
+# === Roll Folder Index ===
+# Maps a Twin Sticker to its folder under rolls/ so page views don't list the
+# bucket. Folders are named "<scan date>_<zero-padded sticker>".
+def sticker_key(value):
+    return value.split("_")[-1].lstrip("0")
+
+class RollFolderIndex:
+    def __init__(self, refresh_interval=ROLL_INDEX_REFRESH_SECONDS, miss_refresh_interval=ROLL_INDEX_MISS_REFRESH_SECONDS):
+        self.refresh_interval = refresh_interval
+        self.miss_refresh_interval = miss_refresh_interval
+        self._folders = {}
+        self._last_refresh = 0.0
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def refresh(self, max_age=0):
+        with self._refresh_lock:
+            # Another thread may have refreshed while we waited for the lock.
+            if self._last_refresh and time.monotonic() - self._last_refresh < max_age:
+                return
+            folders = {}
+            for name in list_roll_folders():
+                key = sticker_key(name)
+                # Keep the first match in sorted order, like the old linear scan.
+                if key not in folders:
+                    folders[key] = name
+            self._folders = folders
+            self._last_refresh = time.monotonic()
+        log(f"🗂️ Roll folder index refreshed: {len(folders)} folders")
+
+    def lookup(self, sticker):
+        self.start()
+        key = sticker_key(sticker)
+        folder = self._folders.get(key)
+        if folder is None:
+            # Unknown sticker: the roll may have been uploaded since the last
+            # refresh. Throttled so bad stickers can't force a listing per hit.
+            self.refresh(max_age=self.miss_refresh_interval)
+            folder = self._folders.get(key)
+        return folder
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="roll-folder-index", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                log(f"❌ Roll folder index refresh failed: {e}")
+
+roll_folder_index = RollFolderIndex()
+
+# === Roll Images & Derivatives ===
+# Web-sized copies of each scan live next to the originals under
+# rolls/<folder>/_thumbs/<kind>/, always as JPEG. Pages show these and link
+# to the full-resolution original.
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+DERIVATIVE_DIR = "_thumbs"
+DERIVATIVE_SIZES = {"thumb": 480, "preview": 1600}  # longest edge in px
+
+def derivative_key(image_key, kind):
+    # The source extension stays in the name (IMG_1.png -> IMG_1.png.jpg) so
+    # IMG_1.jpg and IMG_1.png in one roll don't share derivatives.
+    folder_prefix, filename = image_key.rsplit("/", 1)
+    return f"{folder_prefix}/{DERIVATIVE_DIR}/{kind}/{filename}.jpg"
+
+def is_derivative_key(key):
+    return f"/{DERIVATIVE_DIR}/" in key
+
+def iter_roll_objects(folder):
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=B2_BUCKET_NAME, Prefix=f"rolls/{folder}/"):
+        yield from page.get("Contents", [])
+
+def list_roll_images(folder):
+    # Returns ({image key: byte size} in listing order, set of existing
+    # derivative keys).
+    images = {}
+    derivatives = set()
+    for obj in iter_roll_objects(folder):
+        key = obj["Key"]
+        if is_derivative_key(key):
+            derivatives.add(key)
+        elif key.lower().endswith(IMAGE_EXTENSIONS):
+            images[key] = obj["Size"]
+    return images, derivatives
+
+def list_roll_originals(folder):
+    # Listing entries (Key, Size, LastModified) for the roll's full-size
+    # images, in frame order.
+    objects = [obj for obj in iter_roll_objects(folder)
+               if not is_derivative_key(obj["Key"]) and obj["Key"].lower().endswith(IMAGE_EXTENSIONS)]
+    return sorted(objects, key=lambda obj: natural_sort_key(obj["Key"]))
+
+FRAME_NUMBER_RE = re.compile(r"(\d+)\D*$")
+
+def natural_sort_key(key):
+    # "IMG_2" before "IMG_10": runs of digits compare as numbers.
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", key)]
+
+def parse_frame_number(image_key):
+    # The last number in the file name: IMG_0012.jpg -> 12.
+    stem = image_key.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+    match = FRAME_NUMBER_RE.search(stem)
+    return int(match.group(1)) if match else None
+
+class RollFrameIndex:
+    # A roll's frames in natural order with their numbers parsed once, for
+    # frame number / frame id -> key lookups, plus the derivatives present
+    # and, when known, each frame's byte size.
+    def __init__(self, image_keys, derivatives, sizes=None):
+        self.keys = sorted(image_keys, key=natural_sort_key)
+        self.derivatives = set(derivatives)
+        self.sizes = dict(sizes or {})
+        self.numbers = {key: parse_frame_number(key) for key in self.keys}
+        self._by_number = {}
+        for key, number in self.numbers.items():
+            if number is not None:
+                # None marks a number shared by several files (a rescan, a
+                # second strip), which can't name a single frame.
+                self._by_number[number] = None if number in self._by_number else key
+        self._by_frame = {frame_id(key): key for key in self.keys}
+        self._unrendered = [key for key in self.keys
+                            if any(derivative_key(key, kind) not in self.derivatives for kind in DERIVATIVE_SIZES)]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def key_for_number(self, number):
+        return self._by_number.get(number)
+
+    def key_for_frame(self, frame):
+        return self._by_frame.get(frame)
+
+    def missing_derivatives(self):
+        # Frames that failed to render recently don't count, so one bad scan
+        # doesn't restart generation on every view.
+        return any(not derivative_failed_recently(key) for key in self._unrendered)
+
+def build_image_entries(image_keys, frames):
+    entries = []
+    for key in image_keys:
+        url = generate_signed_url(key)
+        thumb, preview = derivative_key(key, "thumb"), derivative_key(key, "preview")
+        entries.append({
+            "key": key,
+            "frame": frame_id(key),
+            "number": frames.numbers.get(key),
+            "url": url,
+            "thumb_url": generate_signed_url(thumb) if thumb in frames.derivatives else url,
+            "preview_url": generate_signed_url(preview) if preview in frames.derivatives else None,
+        })
+    return entries
+
+class RollImagePage:
+    # The first `limit` images of a roll, listed and signed only when iterated
+    # so a streamed template can flush everything above the tiles first.
+    # next_cursor is known once iteration has finished.
+    def __init__(self, folder, limit):
+        self.folder = folder
+        self.limit = limit
+        self.next_cursor = None
+
+    def __iter__(self):
+        frames = load_roll_frames(self.folder)
+        if frames.missing_derivatives():
+            schedule_roll_derivatives(self.folder)
+        check_roll_zip(self.folder, frames)
+        self.next_cursor = self.limit if len(frames) > self.limit else None
+        for key in frames.keys[:self.limit]:
+            yield build_image_entries([key], frames)[0]
+
+def render_derivatives(data):
+    # Runs in a worker process: decode once, then downscale for every size.
+    from PIL import Image, ImageOps
+
+    largest = max(DERIVATIVE_SIZES.values())
+    with Image.open(io.BytesIO(data)) as img:
+        # JPEG draft mode lets libjpeg decode at a reduced scale directly.
+        img.draft("RGB", (largest, largest))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+    results = {}
+    for kind, size in sorted(DERIVATIVE_SIZES.items(), key=lambda item: -item[1]):
+        img.thumbnail((size, size), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=82, optimize=True, progressive=True)
+        results[kind] = out.getvalue()
+    return results
+
+_derivative_pool = None
+_derivative_pool_lock = threading.Lock()
+
+def get_derivative_pool():
+    global _derivative_pool
+    if _derivative_pool is None:
+        with _derivative_pool_lock:
+            if _derivative_pool is None:
+                _derivative_pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    return _derivative_pool
+
+def generate_roll_derivatives(folder, image_keys=None, derivatives=None, rerender=()):
+    # `rerender` names frames whose scan was replaced: their derivatives exist
+    # but show the old file, and an earlier failure says nothing about the
+    # new one.
+    if image_keys is None:
+        image_keys, derivatives = list_roll_images(folder)
+    rerender = set(rerender)
+    todo = [key for key in image_keys
+            if key in rerender
+            or (any(derivative_key(key, kind) not in derivatives for kind in DERIVATIVE_SIZES)
+                and not derivative_failed_recently(key))]
+    if not todo:
+        return 0
+    s3 = get_s3_client()
+    pool = get_derivative_pool()
+
+    def failed(key, step, error):
+        log(f"❌ Could not {step} derivatives for {key}: {error}")
+        with _derivatives_lock:
+            _derivatives_failed[key] = time.monotonic()
+
+    def download(key):
+        # None if the scan can't be fetched; the rest of the roll carries on.
+        try:
+            return s3.get_object(Bucket=B2_BUCKET_NAME, Key=key)["Body"].read()
+        except Exception as e:
+            failed(key, "download the scan for", e)
+            return None
+
+    def upload(key, data):
+        s3.put_object(Bucket=B2_BUCKET_NAME, Key=key, Body=data, ContentType="image/jpeg")
+
+    created = 0
+    # Work in chunks so only a handful of full-size scans sit in memory.
+    chunk_size = THUMBNAIL_WORKERS * 2
+    with ThreadPoolExecutor(max_workers=chunk_size, thread_name_prefix="derivatives") as io_pool:
+        for i in range(0, len(todo), chunk_size):
+            chunk = todo[i:i + chunk_size]
+            renders = [(key, pool.submit(render_derivatives, data))
+                       for key, data in zip(chunk, io_pool.map(download, chunk)) if data is not None]
+            uploads = []
+            for key, render in renders:
+                try:
+                    uploads.append((key, [io_pool.submit(upload, derivative_key(key, kind), data)
+                                          for kind, data in render.result().items()]))
+                except Exception as e:
+                    failed(key, "render", e)
+            for key, futures in uploads:
+                try:
+                    for future in futures:
+                        future.result()
+                except Exception as e:
+                    failed(key, "upload", e)
+                    continue
+                created += 1
+                with _derivatives_lock:
+                    _derivatives_failed.pop(key, None)
+    log(f"🖼️ Rendered derivatives for {created}/{len(todo)} images in {folder}")
+    return created
+
+_derivatives_in_progress = set()
+_derivatives_failed = {}  # image key -> monotonic time of its last failed render
+_derivatives_lock = threading.Lock()
+
+def derivative_failed_recently(key):
+    with _derivatives_lock:
+        failed_at = _derivatives_failed.get(key)
+    return failed_at is not None and time.monotonic() - failed_at < DERIVATIVE_RETRY_SECONDS
+
+def schedule_roll_derivatives(folder):
+    # Lazy path for page views: render missing derivatives in the background
+    # while the current response falls back to the originals.
+    with _derivatives_lock:
+        if folder in _derivatives_in_progress:
+            return
+        _derivatives_in_progress.add(folder)
+
+    def run():
+        try:
+            if generate_roll_derivatives(folder):
+                roll_frame_cache.invalidate(folder)
+                refresh_roll_manifest(folder)
+        except Exception as e:
+            log(f"❌ Derivative generation failed for {folder}: {e}")
+        finally:
+            with _derivatives_lock:
+                _derivatives_in_progress.discard(folder)
+
+    threading.Thread(target=run, name=f"derivatives-{folder}", daemon=True).start()
+
+# === Roll Zips ===
+# "Download All" serves rolls/<folder>/<sticker>.zip. When it's missing, or the
+# roll's frames have changed since it was built, the originals are streamed
+# from the bucket into a STORE-mode archive (JPEGs don't compress further)
+# that goes back up as a multipart upload, so only one part is ever held in
+# memory. Zips uploaded by hand carry no fingerprint and are left alone.
+# /roll/<sticker>/download.zip sends the same stream straight to the client.
+ZIP_FINGERPRINT_META = "roll-fingerprint"
+ZIP_MIN_PART_SIZE = 5 * 1024 * 1024  # S3 minimum for every part but the last
+
+def roll_zip_key(folder):
+    return f"rolls/{folder}/{folder.split('_')[-1].lstrip('0')}.zip"
+
+def roll_fingerprint(frames):
+    # `frames` are (key, byte size) pairs, so a frame replaced under the same
+    # name changes the fingerprint too.
+    return hashlib.sha1("\n".join(f"{key}\t{size}" for key, size in sorted(frames)).encode()).hexdigest()
+
+def key_only_fingerprint(image_keys):
+    # What zips built before sizes were fingerprinted carry.
+    return hashlib.sha1("\n".join(sorted(image_keys)).encode()).hexdigest()
+
+class ZipChunkSink:
+    # Write-only sink for zipfile that hands back whatever was written since
+    # the last drain(). Having no tell()/seek() makes zipfile write data
+    # descriptors instead of seeking back to patch local headers.
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+def stream_roll_zip(folder, objects):
+    # Yields the zip for `objects` (listing entries) chunk by chunk. Frames are
+    # fetched as ZIP_STREAM_CHUNK byte ranges with up to ZIP_READ_AHEAD ranges
+    # in flight, so memory stays flat however big the roll is.
+    s3 = get_s3_client()
+    prefix = f"rolls/{folder}/"
+    sink = ZipChunkSink()
 
-    for folder in folders:
-        if folder in processed:
-            log(f"⏭️ Already processed: {folder}")
-            continue
+    def fetch(key, start, end):
+        return s3.get_object(Bucket=B2_BUCKET_NAME, Key=key, Range=f"bytes={start}-{end}")["Body"].read()
 
-        twin_sticker = folder.split("_")[-1].lstrip("0")
-        record = find_airtable_record(twin_sticker)
-        if not record:
-            log(f"❌ No Airtable match for {twin_sticker}")
-            continue
+    ranges = ((obj["Key"], start, min(start + ZIP_STREAM_CHUNK, obj["Size"]) - 1)
+              for obj in objects for start in range(0, obj["Size"], ZIP_STREAM_CHUNK))
+    window = deque()
+    pool = ThreadPoolExecutor(max_workers=ZIP_READ_AHEAD, thread_name_prefix="zip-read")
 
-        if record['fields'].get('Email Sent'):
-            log(f"⏭️ Already emailed: {twin_sticker}")
-            continue
+    def fill():
+        for key, start, end in ranges:
+            window.append((key, pool.submit(fetch, key, start, end)))
+            if len(window) >= ZIP_READ_AHEAD:
+                return
+
+    try:
+        fill()
+        archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED)
+        for obj in objects:
+            modified = obj.get("LastModified") or datetime.now()
+            info = zipfile.ZipInfo(obj["Key"][len(prefix):], date_time=modified.timetuple()[:6])
+            # Known up front so zipfile switches to zip64 for huge frames.
+            info.file_size = obj["Size"]
+            with archive.open(info, "w") as entry:
+                remaining = obj["Size"]
+                while remaining > 0:
+                    key, future = window.popleft()
+                    data = future.result()
+                    if key != obj["Key"] or not data:
+                        raise IOError(f"{obj['Key']} changed while it was being zipped")
+                    fill()
+                    entry.write(data)
+                    remaining -= len(data)
+                    yield from sink.drain()
+        archive.close()
+        yield from sink.drain()
+    finally:
+        # Also runs when a client disconnects mid-download.
+        pool.shutdown(wait=False, cancel_futures=True)
+
+class MultipartZipUpload:
+    # Buffers the zip stream and uploads it one part at a time.
+    def __init__(self, key, metadata):
+        self.s3 = get_s3_client()
+        self.key = key
+        self.metadata = metadata
+        self.part_size = max(ZIP_PART_SIZE, ZIP_MIN_PART_SIZE)
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _upload_part(self, data):
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(
+                Bucket=B2_BUCKET_NAME, Key=self.key, ContentType="application/zip", Metadata=self.metadata
+            )["UploadId"]
+        number = len(self.parts) + 1
+        response = self.s3.upload_part(Bucket=B2_BUCKET_NAME, Key=self.key, UploadId=self.upload_id,
+                                       PartNumber=number, Body=data)
+        self.parts.append({"PartNumber": number, "ETag": response["ETag"]})
+
+    def complete(self):
+        if self.upload_id is None:
+            # Smaller than one part: a plain PUT is cheaper than a one-part upload.
+            self.s3.put_object(Bucket=B2_BUCKET_NAME, Key=self.key, Body=bytes(self.buffer),
+                               ContentType="application/zip", Metadata=self.metadata)
+        else:
+            if self.buffer:
+                self._upload_part(bytes(self.buffer))
+            self.s3.complete_multipart_upload(Bucket=B2_BUCKET_NAME, Key=self.key, UploadId=self.upload_id,
+                                              MultipartUpload={"Parts": self.parts})
+        self.buffer = bytearray()
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=B2_BUCKET_NAME, Key=self.key, UploadId=self.upload_id)
+
+def build_roll_zip(folder, objects, fingerprint):
+    started = time.monotonic()
+    upload = MultipartZipUpload(roll_zip_key(folder), {ZIP_FINGERPRINT_META: fingerprint})
+    try:
+        for chunk in stream_roll_zip(folder, objects):
+            upload.write(chunk)
+        upload.complete()
+    except Exception:
+        upload.abort()
+        raise
+    log(f"🗜️ Built {roll_zip_key(folder)}: {len(objects)} images, "
+        f"{upload.size / 1024 / 1024:.1f} MB in {time.monotonic() - started:.1f}s")
+
+def head_roll_zip(folder):
+    try:
+        return get_s3_client().head_object(Bucket=B2_BUCKET_NAME, Key=roll_zip_key(folder))
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+
+_zips_ready = {}        # folder -> fingerprint of the zip in the bucket (None if uploaded by hand)
+_zips_in_progress = set()
+_zips_failed = {}       # folder -> monotonic time of the last failed build
+_zips_lock = threading.Lock()
+
+def ensure_roll_zip(folder):
+    # Builds the zip unless the bucket already has one for these frames.
+    objects = list_roll_originals(folder)
+    if not objects:
+        log(f"⏭️ No images to zip in {folder}")
+        return False
+    fingerprint = roll_fingerprint((obj["Key"], obj["Size"]) for obj in objects)
+    existing = head_roll_zip(folder)
+    if existing is not None:
+        current = existing.get("Metadata", {}).get(ZIP_FINGERPRINT_META)
+        if current is None or current == fingerprint:
+            with _zips_lock:
+                _zips_ready[folder] = current
+            return False
+    build_roll_zip(folder, objects, fingerprint)
+    with _zips_lock:
+        _zips_ready[folder] = fingerprint
+        _zips_failed.pop(folder, None)
+    return True
+
+def _claim_roll_zip(folder):
+    with _zips_lock:
+        if folder in _zips_in_progress:
+            return False
+        failed_at = _zips_failed.get(folder)
+        if failed_at is not None and time.monotonic() - failed_at < ZIP_RETRY_SECONDS:
+            return False
+        _zips_in_progress.add(folder)
+        return True
+
+def _run_roll_zip(folder, refresh_manifest=False):
+    try:
+        if ensure_roll_zip(folder) and refresh_manifest:
+            refresh_roll_manifest(folder)
+    except Exception as e:
+        log(f"❌ Zip build failed for {folder}: {e}")
+        with _zips_lock:
+            _zips_failed[folder] = time.monotonic()
+    finally:
+        with _zips_lock:
+            _zips_in_progress.discard(folder)
+
+def prepare_roll_zip(folder):
+    # Ingest path: build inline, unless a page view already started one. The
+    # manifest was written before the email went out, so it's refreshed.
+    if _claim_roll_zip(folder):
+        _run_roll_zip(folder, refresh_manifest=True)
+
+def schedule_roll_zip(folder):
+    # Page-view path: build in the background while the page says "preparing".
+    if _claim_roll_zip(folder):
+        threading.Thread(target=_run_roll_zip, args=(folder, True), name=f"zip-{folder}", daemon=True).start()
+
+def roll_zip_state(folder):
+    # "ready", "preparing" or "unavailable" (last build failed recently).
+    # Only the first check per folder touches the bucket.
+    with _zips_lock:
+        if folder in _zips_ready:
+            return "ready"
+        if folder in _zips_in_progress:
+            return "preparing"
+    manifest = load_roll_manifest(folder)
+    if manifest and manifest.get("zip"):
+        with _zips_lock:
+            _zips_ready[folder] = manifest.get("zip_fingerprint")
+        return "ready"
+    existing = head_roll_zip(folder)
+    if existing is not None:
+        with _zips_lock:
+            _zips_ready[folder] = existing.get("Metadata", {}).get(ZIP_FINGERPRINT_META)
+        return "ready"
+    schedule_roll_zip(folder)
+    with _zips_lock:
+        return "preparing" if folder in _zips_in_progress else "unavailable"
+
+def check_roll_zip(folder, frames):
+    # Called wherever a roll gets listed anyway: rebuild a generated zip whose
+    # frames no longer match the folder. Zips from before sizes were part of
+    # the fingerprint are kept while their keys still match, rather than
+    # rebuilding the archive's zips on their next view; ingest and the
+    # refresh phase compare sizes and rebuild those when a frame changes.
+    with _zips_lock:
+        if folder not in _zips_ready:
+            return
+        current = _zips_ready[folder]
+    if current is None or current == key_only_fingerprint(frames.keys):
+        return
+    if current != roll_fingerprint((key, frames.sizes.get(key)) for key in frames.keys):
+        schedule_roll_zip(folder)
+
+# === Roll Manifests ===
+# rolls/<folder>/manifest.json describes a roll so pages don't have to list
+# the prefix: frames in display order with their byte size, pixel size and
+# derivative keys, plus the zip and its fingerprint. main() writes it at ingest
+# after the thumbnails and again once the zip is built, and rewrites it on
+# later triggers if a recent roll gains frames; `backfill-manifests` writes it
+# for older rolls. Rolls without one fall back to listing.
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+MANIFEST_HEADER_BYTES = 256 * 1024  # enough for JPEG EXIF + SOF in practice
+
+def manifest_key(folder):
+    return f"rolls/{folder}/{MANIFEST_NAME}"
+
+def read_image_dimensions(key):
+    # (width, height) as displayed, read from the start of the file only.
+    from PIL import Image
+
+    data = get_s3_client().get_object(
+        Bucket=B2_BUCKET_NAME, Key=key, Range=f"bytes=0-{MANIFEST_HEADER_BYTES - 1}"
+    )["Body"].read()
+    with Image.open(io.BytesIO(data)) as img:
+        width, height = img.size
+        # EXIF orientations 5-8 are rotated by 90°, which swaps the sides.
+        if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+            width, height = height, width
+    return width, height
+
+def build_roll_manifest(folder, previous=None):
+    objects = list(iter_roll_objects(folder))
+    keys = {obj["Key"] for obj in objects}
+    originals = sorted((obj for obj in objects
+                        if not is_derivative_key(obj["Key"]) and obj["Key"].lower().endswith(IMAGE_EXTENSIONS)),
+                       key=lambda obj: natural_sort_key(obj["Key"]))
+    # Dimensions only change with the file, so reuse what the last manifest
+    # had for frames with the same key and size.
+    known = {(frame["key"], frame["size"]): (frame["width"], frame["height"])
+             for frame in (previous or {}).get("frames", [])}
+
+    def dimensions(obj):
+        cached = known.get((obj["Key"], obj["Size"]))
+        if cached:
+            return cached
+        try:
+            return read_image_dimensions(obj["Key"])
+        except Exception as e:
+            log(f"⚠️ Could not read dimensions of {obj['Key']}: {e}")
+            return None, None
+
+    with ThreadPoolExecutor(max_workers=8, thread_name_prefix="manifest") as pool:
+        sizes = list(pool.map(dimensions, originals))
+
+    frames = []
+    for obj, (width, height) in zip(originals, sizes):
+        frame = {"key": obj["Key"], "size": obj["Size"], "width": width, "height": height}
+        for kind in DERIVATIVE_SIZES:
+            derivative = derivative_key(obj["Key"], kind)
+            frame[kind] = derivative if derivative in keys else None
+        frames.append(frame)
+
+    zip_key = roll_zip_key(folder)
+    zip_head = head_roll_zip(folder) if zip_key in keys else None
+    return {
+        "version": MANIFEST_VERSION,
+        "folder": folder,
+        "generated_at": datetime.utcnow().isoformat(),
+        "frames": frames,
+        "zip": zip_key if zip_head else None,
+        "zip_fingerprint": zip_head.get("Metadata", {}).get(ZIP_FINGERPRINT_META) if zip_head else None,
+    }
 
-        email = record['fields'].get('Client Email')
-        if not email:
-            log(f"❌ Missing Client Email in Airtable record")
+def write_roll_manifest(folder, previous=None):
+    manifest = build_roll_manifest(folder, previous)
+    get_s3_client().put_object(
+        Bucket=B2_BUCKET_NAME, Key=manifest_key(folder),
+        Body=json.dumps(manifest, separators=(",", ":")).encode(),
+        ContentType="application/json", CacheControl="no-cache"
+    )
+    roll_manifest_cache.put(folder, manifest)
+    roll_frame_cache.invalidate(folder)
+    log(f"📋 Wrote manifest for {folder}: {len(manifest['frames'])} frames")
+    return manifest
+
+def refresh_roll_manifest(folder):
+    # After derivatives or a zip appear outside ingest, keep an existing
+    # manifest in step. Rolls without one wait for ingest or the backfill.
+    previous = load_roll_manifest(folder)
+    if previous is not None:
+        write_roll_manifest(folder, previous)
+
+class RollCache:
+    # Per-roll LRU whose entries expire after `ttl` seconds. Holds parsed
+    # manifests, including "no manifest" so older rolls don't cost a GET on
+    # every view, and the frame indexes built from them.
+    def __init__(self, max_size=MANIFEST_CACHE_SIZE, ttl=MANIFEST_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, folder):
+        # Returns (found, value); value may be None for "known missing".
+        with self._lock:
+            entry = self._entries.get(folder)
+            if entry is None or time.monotonic() - entry[1] > self.ttl:
+                return False, None
+            self._entries.move_to_end(folder)
+            return True, entry[0]
+
+    def put(self, folder, value):
+        with self._lock:
+            self._entries[folder] = (value, time.monotonic())
+            self._entries.move_to_end(folder)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, folder):
+        with self._lock:
+            self._entries.pop(folder, None)
+
+roll_manifest_cache = RollCache()
+roll_frame_cache = RollCache()
+
+def load_roll_manifest(folder):
+    found, manifest = roll_manifest_cache.get(folder)
+    if found:
+        return manifest
+    try:
+        body = get_s3_client().get_object(Bucket=B2_BUCKET_NAME, Key=manifest_key(folder))["Body"].read()
+        manifest = json.loads(body)
+        if manifest.get("version") != MANIFEST_VERSION:
+            manifest = None
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+            raise
+        manifest = None
+    roll_manifest_cache.put(folder, manifest)
+    return manifest
+
+def load_roll_frames(folder):
+    # The roll's RollFrameIndex, from the manifest when there is one.
+    found, frames = roll_frame_cache.get(folder)
+    if found:
+        return frames
+    manifest = load_roll_manifest(folder)
+    if manifest is None:
+        images, derivatives = list_roll_images(folder)
+        frames = RollFrameIndex(images, derivatives, images)
+    else:
+        frames = RollFrameIndex(
+            [frame["key"] for frame in manifest["frames"]],
+            {frame[kind] for frame in manifest["frames"] for kind in DERIVATIVE_SIZES if frame.get(kind)},
+            {frame["key"]: frame["size"] for frame in manifest["frames"]}
+        )
+    roll_frame_cache.put(folder, frames)
+    return frames
+
+def backfill_manifests(folders=None, force=False):
+    written = 0
+    for folder in folders or list_roll_folders():
+        if not force and load_roll_manifest(folder) is not None:
             continue
+        try:
+            write_roll_manifest(folder, load_roll_manifest(folder))
+            written += 1
+        except Exception as e:
+            log(f"❌ Manifest failed for {folder}: {e}")
+    log(f"📋 Backfilled {written} manifests")
+    return written
+
+# === Pricing ===
+# The one price table. review_order, finalize_order and the webhook price
+# orders through price_order(), and the confirm page's JS reads the same
+# table from the `pricing` template global.
+PRINT_PRICES = {"10x15": 0.75, "A6": 1.5, "A5": 3.0, "A4": 6.0, "A3": 12.0}  # € incl. VAT
+# Roll caps: an order made only of `size` prints, with at least `min_prints`
+# of them, costs at most `cap` on a roll of this film size.
+PRICE_CAPS = {
+    "35mm": {"size": "10x15", "min_prints": 20, "cap": 15.0},
+    "Half Frame": {"size": "10x15", "min_prints": 0, "cap": 25.0},
+}
+VAT_RATE = 0.21
 
-        password = generate_password()
-        update_airtable_record(record['id'], {"Password": password})
+def order_total(sizes, roll_size):
+    cap = PRICE_CAPS.get(roll_size)
+    total = 0.0
+    prints = 0
+    capped_prints = 0
+    for size in sizes:
+        total += PRINT_PRICES.get(size, 0.0)
+        prints += 1
+        if cap and size == cap["size"]:
+            capped_prints += 1
+    if cap and capped_prints == prints and capped_prints >= cap["min_prints"]:
+        total = min(total, cap["cap"])
+    return total
+
+def vat_part(total):
+    return total * VAT_RATE / (1 + VAT_RATE)
+
+def price_order(items, roll_size):
+    # Returns (items with their list price, counts per "size - paper", total).
+    priced = []
+    type_counter = {}
+    for item in items:
+        key = f"{item['size']} - {item['paper']}"
+        type_counter[key] = type_counter.get(key, 0) + 1
+        priced.append({**item, "price": PRINT_PRICES.get(item["size"], 0.0)})
+    return priced, type_counter, order_total((item["size"] for item in priced), roll_size)
+
+app.jinja_env.globals["pricing"] = {"prices": PRINT_PRICES, "caps": PRICE_CAPS, "vat_rate": VAT_RATE}
+
+# === Print Orders ===
+# Order forms and the stored Print Order JSON refer to frames by their path
+# inside the roll folder ("IMG_1234.jpg"); signed URLs are only made when a
+# page or email is rendered. Orders stored before this carry "url" instead.
+# Stored orders also keep each frame's number, so a frame renamed since the
+# order was placed (a rescan exported under new names) is still found.
+ORDER_DEFAULTS = {"size": "10x15", "paper": "Glossy", "border": "No"}
+ORDER_FIELDS = ("frame", "number") + tuple(ORDER_DEFAULTS)
+
+def frame_id(image_key):
+    return image_key.split("/", 2)[2]
+
+def frame_from_url(url):
+    # Recovers the frame from an old presigned URL's path.
+    path = unquote(urlparse(url or "").path)
+    start = path.find("/rolls/")
+    if start == -1:
+        return None
+    parts = path[start + 1:].split("/", 2)
+    return parts[2] if len(parts) == 3 else None
+
+def read_order_form(form):
+    # order[<i>][frame|size|paper|border] fields in form order. Pages rendered
+    # before frame ids existed post order[<i>][url] instead.
+    items = []
+    for key in form:
+        if key.startswith('order[') and key.endswith(('][frame]', '][url]')):
+            index = key.split('[')[1].split(']')[0]
+            if key.endswith('][url]') and f'order[{index}][frame]' in form:
+                continue
+            frame = form.get(f'order[{index}][frame]') or frame_from_url(form.get(f'order[{index}][url]'))
+            item = {"frame": frame}
+            for field, default in ORDER_DEFAULTS.items():
+                item[field] = form.get(f'order[{index}][{field}]', default)
+            items.append(item)
+    return items
+
+def load_print_order(raw):
+    # Parses stored Print Order JSON, including the old url-based entries.
+    items = []
+    for stored in json.loads(raw or "[]"):
+        item = {"frame": stored.get("frame") or frame_from_url(stored.get("url")), "number": stored.get("number")}
+        for field, default in ORDER_DEFAULTS.items():
+            item[field] = stored.get(field, default)
+        if not item["frame"] and stored.get("url"):
+            item["url"] = stored["url"]
+        items.append(item)
+    return items
+
+def resolve_order_frames(folder, items, keep_unknown=False):
+    # Adds signed url/thumb_url to each item. Frames that aren't in the roll
+    # are dropped, unless keep_unknown (a paid order must list every print).
+    frames = load_roll_frames(folder) if folder else RollFrameIndex([], set())
+    resolved = []
+    for item in items:
+        key = frames.key_for_frame(item["frame"])
+        extra = {}
+        if not key and item.get("number") is not None:
+            # The file was renamed since the order was placed; find it by its
+            # number, and keep the name that was ordered so the lab can check.
+            key = frames.key_for_number(item["number"])
+            extra = {"ordered_frame": item["frame"]} if key else {}
+        if key:
+            entry = build_image_entries([key], frames)[0]
+            resolved.append({**item, **extra, "frame": entry["frame"], "number": entry["number"],
+                             "url": entry["url"], "thumb_url": entry["thumb_url"]})
+        elif keep_unknown or item.get("url"):
+            url = item.get("url")
+            resolved.append({**item, "number": item.get("number"), "url": url, "thumb_url": url})
+    return resolved
+
+def order_frame_label(item):
+    name = item["frame"] or unquote(urlparse(item.get("url") or "").path.split("/")[-1]) or "unknown frame"
+    if item.get("ordered_frame") and item["ordered_frame"] != item["frame"]:
+        name = f"{name} (was {item['ordered_frame']})"
+    return f"#{item['number']} – {name}" if item.get("number") is not None else name
 
-        gallery_link = f"https://scans.gilplaquet.com/roll/{twin_sticker}"
-        order_link = f"https://scans.gilplaquet.com/roll/{twin_sticker}/order"
-        subject = f"Your Scans Are Ready - Roll {twin_sticker}"
-        body = f"""
+# === Main ===
+def compose_scans_ready_email(twin_sticker, password):
+    gallery_link = f"https://scans.gilplaquet.com/roll/{twin_sticker}"
+    order_link = f"https://scans.gilplaquet.com/roll/{twin_sticker}/order"
+    subject = f"Your Scans Are Ready - Roll {twin_sticker}"
+    body = f"""
 Hi there,
 
 Good news! A roll you sent in for development just got scanned.
@@ -224,33 +1849,644 @@ These links will remain active for 7 days.
 Gil Plaquet
 www.gilplaquet.com
         """
+    return subject, body
+
+def should_run_full_scan(force=False):
+    if force or not state_store.get_meta("scan_cursor"):
+        return True
+    last_full = state_store.get_meta("last_full_scan")
+    if not last_full:
+        return True
+    elapsed = (datetime.utcnow() - datetime.fromisoformat(last_full)).total_seconds()
+    return elapsed >= FULL_SCAN_INTERVAL_HOURS * 3600 - FULL_SCAN_SLACK_MINUTES * 60
+
+def iter_scan_folders(full):
+    # Incremental runs list only folders from a few days before the
+    # high-water mark on, plus the known folders below it that were listed or
+    # failed but never emailed. Full runs re-list everything so folders that
+    # sort below that still get picked up.
+    if full:
+        yield from list_roll_folders()
+        return
+    seen = set()
+    for folder in state_store.unprocessed_folders():
+        seen.add(folder)
+        yield folder
+    for folder in list_roll_folders(start_after=scan_start_after(state_store.get_meta("scan_cursor"))):
+        if folder not in seen:
+            yield folder
+
+def main(job=None):
+    job = job or TriggerJob()
+    log("🚀 Script triggered.")
+    with job.phase("prefetch"):
+        unsent_records = fetch_unsent_airtable_records()
+
+    full = should_run_full_scan(job.full_scan)
+    job.scan_mode = "full" if full else "incremental"
+    log(f"🔎 Running {job.scan_mode} scan")
+    cursor = state_store.get_meta("scan_cursor")
+    pending = []
+    unmatched = []
+    with job.phase("listing"):
+        for folder in iter_scan_folders(full):
+            job.count("seen")
+            if cursor is None or folder > cursor:
+                cursor = folder
+            if state_store.is_processed(folder):
+                log(f"⏭️ Already processed: {folder}")
+                job.count("skipped")
+                continue
+            if not ROLL_FOLDER_DATE_RE.match(folder) and state_store.get(folder) is None:
+                log(f"⚠️ {folder} isn't named <YYYYMMDD>_<sticker>; incremental scans can miss folders like it")
+                job.count("misnamed")
+            state_store.set_status(folder, "listed")
+
+            twin_sticker = folder.split("_")[-1].lstrip("0")
+            if unsent_records is not None:
+                record = unsent_records.get(twin_sticker)
+                if not record:
+                    # Already emailed, or not in Airtable yet; looked up
+                    # together below.
+                    unmatched.append((folder, twin_sticker))
+                    continue
+            else:
+                record = find_airtable_record(twin_sticker)
+                if not record:
+                    log(f"❌ No Airtable match for {twin_sticker}")
+                    job.count("skipped")
+                    continue
+            queue_roll_email(folder, twin_sticker, record, pending, job)
+
+        # Without this, rolls emailed before the state store existed would
+        # stay "listed" and be re-checked on every run.
+        if unmatched:
+            records = fetch_airtable_records_by_sticker(twin_sticker for _, twin_sticker in unmatched)
+            for folder, twin_sticker in unmatched:
+                record = records.get(twin_sticker) if records is not None else None
+                if not record:
+                    log(f"❌ No Airtable match for {twin_sticker}")
+                    job.count("skipped")
+                    continue
+                queue_roll_email(folder, twin_sticker, record, pending, job)
+
+    if cursor:
+        state_store.set_meta("scan_cursor", cursor)
+    if full:
+        state_store.set_meta("last_full_scan", datetime.utcnow().isoformat())
+
+    if pending:
+        email_new_rolls(pending, job)
+    else:
+        log("✅ No new rolls to process.")
+
+    with job.phase("refresh"):
+        refresh_recent_rolls(skip={folder for folder, _, _, _ in pending})
+
+def email_new_rolls(pending, job):
+    # Passwords must be stored before the email that contains them goes out.
+    with job.phase("passwords"):
+        passwords = {record['id']: generate_password() for _, _, record, _ in pending}
+        saved = update_airtable_records([(record_id, {"Password": pw}) for record_id, pw in passwords.items()])
+
+    # Rolls run through a bounded pool: each waits on its own delivery, and
+    # delivered rolls are marked Email Sent in batches as they complete.
+    # Airtable pacing is shared through the client's token bucket.
+    marker = EmailSentMarker(job)
+    to_send = []
+    for folder, twin_sticker, record, email in pending:
+        if record['id'] not in saved:
+            log(f"❌ Password not saved, skipping email for {twin_sticker}")
+            state_store.set_status(folder, "failed", "Password not saved")
+            job.count("failed")
+            continue
+        to_send.append((folder, twin_sticker, record, email, passwords[record['id']]))
+
+    with job.phase("emails"):
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=TRIGGER_CONCURRENCY, thread_name_prefix="roll") as pool:
+            durations = list(pool.map(lambda roll: process_roll(*roll, marker=marker, job=job), to_send))
+        marker.flush()
+        elapsed = time.monotonic() - started
+
+    sequential = sum(durations)
+    job.set_timing("emails_sequential_estimate", sequential)
+    log(f"⏱️ {len(to_send)} rolls in {elapsed:.1f}s with concurrency {TRIGGER_CONCURRENCY} "
+        f"(~{max(0.0, sequential - elapsed):.1f}s saved vs one at a time)")
+
+    # Build "Download All" zips now rather than on first click, but only
+    # once every customer has their email: each build pulls and re-uploads
+    # the whole roll, and download.zip streams the roll until it's there.
+    if ZIP_ON_INGEST:
+        with job.phase("zips"):
+            with ThreadPoolExecutor(max_workers=TRIGGER_CONCURRENCY, thread_name_prefix="zip") as pool:
+                list(pool.map(lambda roll: prepare_roll_zip(roll[0]), to_send))
+
+def refresh_recent_rolls(skip=()):
+    # Rolls are emailed as soon as their first scan is in the bucket, and
+    # pages only read the manifest, so while their links work the rolls
+    # emailed lately are listed again here. One whose frames changed gets
+    # derivatives, a new manifest and a rebuilt zip.
+    since = datetime.utcnow() - timedelta(days=MANIFEST_REFRESH_DAYS)
+    refreshed = 0
+    for folder in state_store.emailed_since(since):
+        if folder in skip:
+            continue
+        try:
+            if refresh_roll(folder):
+                refreshed += 1
+        except Exception as e:
+            log(f"❌ Refresh failed for {folder}: {e}")
+    if refreshed:
+        log(f"🔄 Refreshed {refreshed} rolls with new or changed frames")
+
+def refresh_roll(folder):
+    manifest = load_roll_manifest(folder)
+    if manifest is None:
+        # Rolls from before manifests are backfill-manifests' job, not ours.
+        return False
+    objects = [obj for obj in iter_roll_objects(folder)
+               if not is_derivative_key(obj["Key"]) and obj["Key"].lower().endswith(IMAGE_EXTENSIONS)]
+    listed = {(obj["Key"], obj["Size"]) for obj in objects}
+    changed = listed - {(frame["key"], frame["size"]) for frame in manifest["frames"]}
+    if not changed and len(listed) == len(manifest["frames"]):
+        return False
+    log(f"🔄 Frames changed in {folder}")
+    # New frames have no derivatives yet; replaced ones need theirs redone.
+    generate_roll_derivatives(folder, rerender={key for key, _ in changed})
+    write_roll_manifest(folder, manifest)
+    if ZIP_ON_INGEST:
+        prepare_roll_zip(folder)
+    return True
+
+def queue_roll_email(folder, twin_sticker, record, pending, job):
+    # Adds the roll to `pending` if its customer still needs the email.
+    if record['fields'].get('Email Sent'):
+        log(f"⏭️ Already emailed: {twin_sticker}")
+        # Not stamped: it wasn't sent now, and refresh_recent_rolls() goes
+        # by emailed_at.
+        state_store.set_status(folder, "emailed", stamp=False)
+        job.count("skipped")
+        return
 
-        send_email(email, subject, body)
-        update_airtable_record(record['id'], {"Email Sent": True})
-        save_processed(folder)
-        log(f"✅ Processed and emailed: {twin_sticker}")
+    email = record['fields'].get('Client Email')
+    if not email:
+        log(f"❌ Missing Client Email in Airtable record")
+        state_store.set_status(folder, "failed", "Missing Client Email")
+        job.count("failed")
+        return
 
-# === Flask Routes ===
-@app.route('/')
-def index():
-    return "🟢 Render is online."
+    pending.append((folder, twin_sticker, record, email))
+
+def prepare_roll(folder, job):
+    # Render web-sized derivatives before the customer gets their link, so
+    # the first gallery view doesn't pull full-resolution scans, then write
+    # the manifest that records them.
+    with job.phase("thumbnails"):
+        try:
+            generate_roll_derivatives(folder)
+        except Exception as e:
+            log(f"❌ Derivative generation failed for {folder}: {e}")
+    with job.phase("manifests"):
+        try:
+            write_roll_manifest(folder, load_roll_manifest(folder))
+        except Exception as e:
+            log(f"❌ Manifest failed for {folder}: {e}")
+
+def process_roll(folder, twin_sticker, record, email, password, marker, job):
+    # Each roll waits only for its own derivatives before its email goes out.
+    started = time.monotonic()
+    prepare_roll(folder, job)
+    subject, body = compose_scans_ready_email(twin_sticker, password)
+    if send_email(email, subject, body).wait():
+        marker.add(folder, twin_sticker, record)
+    else:
+        log(f"❌ Email not delivered for {twin_sticker}, will retry on next trigger")
+        state_store.set_status(folder, "failed", "Email not delivered")
+        job.count("failed")
+    return time.monotonic() - started
+
+class EmailSentMarker:
+    # Only rolls whose email was delivered get here, and a folder is only
+    # recorded as processed once Airtable has accepted its Email Sent flag.
+    # A batch goes out when it's full or flush_seconds after its first roll,
+    # so a crash mid-run can't leave delivered rolls unmarked for long (the
+    # next run would mail them again with a new password).
+    def __init__(self, job, flush_seconds=EMAIL_SENT_FLUSH_SECONDS):
+        self.job = job
+        self.flush_seconds = flush_seconds
+        self._pending = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, folder, twin_sticker, record):
+        with self._lock:
+            self._pending.append((folder, twin_sticker, record))
+            if len(self._pending) < AIRTABLE_BATCH_SIZE:
+                if self._timer is None:
+                    self._timer = threading.Timer(self.flush_seconds, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            batch = self._take()
+        self._mark(batch)
+
+    def flush(self):
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._mark(batch)
+
+    def _take(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        return batch
+
+    def _mark(self, batch):
+        marked = update_airtable_records([(record['id'], {"Email Sent": True}) for _, _, record in batch])
+        for folder, twin_sticker, record in batch:
+            if record['id'] not in marked:
+                log(f"❌ Email sent but Email Sent not saved for {twin_sticker}")
+                state_store.set_status(folder, "failed", "Email Sent not saved")
+                self.job.count("failed")
+                continue
+            save_processed(folder)
+            self.job.count("emailed")
+            log(f"✅ Processed and emailed: {twin_sticker}")
+
+# === Trigger Jobs ===
+# /trigger runs main() on a background thread so the batch isn't bound by the
+# proxy's request timeout. A trigger that arrives while a run is in flight is
+# handed the existing job instead of starting a second one.
+class TriggerJob:
+    def __init__(self, full_scan=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.full_scan = full_scan
+        self.scan_mode = None
+        self.status = "queued"
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+        self.counts = {"seen": 0, "emailed": 0, "skipped": 0, "failed": 0, "misnamed": 0}
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] += amount
+
+    def set_timing(self, name, seconds):
+        with self._lock:
+            self.timings[name] = round(seconds, 3)
+
+    @contextmanager
+    def phase(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.timings[name] = round(self.timings.get(name, 0) + time.monotonic() - started, 3)
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "scan_mode": self.scan_mode,
+                "error": self.error,
+                "created_at": self.created_at.isoformat() + "Z",
+                "started_at": self.started_at.isoformat() + "Z" if self.started_at else None,
+                "finished_at": self.finished_at.isoformat() + "Z" if self.finished_at else None,
+                "counts": dict(self.counts),
+                "timings": dict(self.timings),
+            }
 
-@app.route('/trigger')
-def trigger():
-    if request.args.get("token") != TRIGGER_TOKEN:
-        return "❌ Unauthorized", 403
+_trigger_jobs = OrderedDict()
+_trigger_jobs_lock = threading.Lock()
+
+def submit_trigger_job(full_scan=False):
+    # Returns (job, created). created is False when an active run was reused.
+    with _trigger_jobs_lock:
+        for job in reversed(_trigger_jobs.values()):
+            if job.active:
+                return job, False
+        job = TriggerJob(full_scan=full_scan)
+        _trigger_jobs[job.id] = job
+        while len(_trigger_jobs) > TRIGGER_JOB_HISTORY:
+            _trigger_jobs.popitem(last=False)
+    threading.Thread(target=run_trigger_job, args=(job,), name=f"trigger-{job.id}", daemon=True).start()
+    return job, True
+
+def get_trigger_job(job_id):
+    with _trigger_jobs_lock:
+        return _trigger_jobs.get(job_id)
+
+def run_trigger_job(job):
+    job.status = "running"
+    job.started_at = datetime.utcnow()
+    try:
+        main(job)
+        job.status = "succeeded"
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+        log(f"❌ Trigger job {job.id} failed: {e}")
+    finally:
+        job.finished_at = datetime.utcnow()
+        log(f"🏁 Trigger job {job.id} {job.status}: {job.counts} {job.timings}")
+
+# === Payment Gateway ===
+# Checkout and the webhook talk to a gateway with two methods:
+#   create_payment(amount, description, redirect_url, webhook_url, metadata)
+#   get_payment(payment_id)
+# Both return an object with .id, .status, .checkout_url and .is_paid().
+# get_payment raises UnknownPaymentError for ids the provider doesn't know.
+# One gateway is built per process on first use. The Mollie client keeps a
+# single requests session, so connections to the API are pooled.
+class UnknownPaymentError(Exception):
+    pass
+
+class MolliePaymentGateway:
+    def __init__(self, api_key):
+        self.client = MollieClient()
+        self.client.set_api_key(api_key)
+
+    def create_payment(self, amount, description, redirect_url, webhook_url, metadata):
+        return self.client.payments.create({
+            "amount": {
+                "currency": "EUR",
+                "value": f"{amount:.2f}"
+            },
+            "description": description,
+            "redirectUrl": redirect_url,
+            "webhookUrl": webhook_url,
+            "metadata": metadata
+        })
+
+    def get_payment(self, payment_id):
+        try:
+            return self.client.payments.get(payment_id)
+        except (IdentifierError, NotFoundError) as e:
+            raise UnknownPaymentError(str(e)) from e
+
+class FakePayment:
+    def __init__(self, payment_id, amount, metadata, checkout_url, status):
+        self.id = payment_id
+        self.amount = amount
+        self.metadata = metadata
+        self.checkout_url = checkout_url
+        self.status = status
+
+    def is_paid(self):
+        return self.status == "paid"
+
+class FakePaymentGateway:
+    # In-memory stand-in for running checkout without a Mollie account.
+    # Checkout goes straight to the redirect URL; payments are created
+    # already paid unless auto_pay is off, then set_status() moves them on.
+    def __init__(self, auto_pay=True):
+        self.auto_pay = auto_pay
+        self.payments = {}
+        self._lock = threading.Lock()
+
+    def create_payment(self, amount, description, redirect_url, webhook_url, metadata):
+        payment = FakePayment(f"tr_fake_{uuid.uuid4().hex[:10]}", amount, metadata, redirect_url,
+                              "paid" if self.auto_pay else "open")
+        with self._lock:
+            self.payments[payment.id] = payment
+        return payment
+
+    def get_payment(self, payment_id):
+        with self._lock:
+            payment = self.payments.get(payment_id)
+        if payment is None:
+            raise UnknownPaymentError(f"Unknown payment {payment_id}")
+        return payment
+
+    def set_status(self, payment_id, status):
+        self.get_payment(payment_id).status = status
+
+_payment_gateway = None
+_payment_gateway_lock = threading.Lock()
+
+def create_payment_gateway():
+    if PAYMENT_GATEWAY == "fake":
+        return FakePaymentGateway()
+    if not MOLLIE_API_KEY:
+        return None
+    return MolliePaymentGateway(MOLLIE_API_KEY)
+
+def get_payment_gateway():
+    # None when no Mollie API key is configured.
+    global _payment_gateway
+    if _payment_gateway is None:
+        with _payment_gateway_lock:
+            if _payment_gateway is None:
+                _payment_gateway = create_payment_gateway()
+    return _payment_gateway
+
+# === Payment Webhooks ===
+# /mollie-webhook records the payment id in the state store, queues it and
+# answers straight away. Mollie can deliver the same payment several times;
+# workers fetch it, claim (payment id, status) in the ledger and run the side
+# effects once. Mollie has already had its 200, so a failed attempt is retried
+# from the ledger with backoff, and a sweeper re-queues whatever is due there,
+# including webhooks a restart cut short.
+class WebhookQueue:
+    def __init__(self, workers=WEBHOOK_WORKERS, max_attempts=WEBHOOK_MAX_ATTEMPTS, sweep_interval=WEBHOOK_SWEEP_SECONDS):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.sweep_interval = sweep_interval
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def enqueue(self, payment_id):
+        # False when the payment is already waiting or being handled.
+        with self._lock:
+            if payment_id in self._pending:
+                return False
+            self._pending.add(payment_id)
+        self.start()
+        self._queue.put(payment_id)
+        return True
+
+    def start(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"webhook-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._sweep, name="webhook-sweep", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def drain(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+    def _run(self):
+        while True:
+            payment_id = self._queue.get()
+            try:
+                self._process(payment_id)
+            finally:
+                with self._lock:
+                    self._pending.discard(payment_id)
+                self._queue.task_done()
+
+    def _sweep(self):
+        # Runs once at start, which picks up what a previous process left.
+        while True:
+            try:
+                for payment_id in state_store.due_webhooks():
+                    self.enqueue(payment_id)
+            except Exception as e:
+                log(f"❌ Webhook sweep failed: {e}")
+            time.sleep(self.sweep_interval)
+
+    def _process(self, payment_id):
+        attempt = state_store.start_webhook(payment_id)
+        try:
+            process_payment(payment_id)
+        except UnknownPaymentError:
+            # Nothing to retry; this also keeps made-up ids posted to the
+            # open endpoint from holding a worker.
+            log(f"⏭️ Webhook for unknown payment {payment_id} dropped")
+            state_store.finish_webhook(payment_id)
+        except Exception as e:
+            if attempt < self.max_attempts:
+                delay = min(3600, WEBHOOK_RETRY_SECONDS * 2 ** (attempt - 1))
+                log(f"⚠️ Webhook for {payment_id} failed ({e}), retrying in {delay}s")
+                state_store.finish_webhook(payment_id, str(e), datetime.utcnow() + timedelta(seconds=delay))
+            else:
+                log(f"❌ Webhook for {payment_id} failed {attempt} times, giving up: {e}")
+                state_store.finish_webhook(payment_id, str(e))
+        else:
+            state_store.finish_webhook(payment_id)
+
+def process_payment(payment_id):
+    payment = get_payment_gateway().get_payment(payment_id)
+    if not state_store.claim_payment(payment_id, payment.status):
+        log(f"⏭️ Webhook for {payment_id} ({payment.status}) already handled")
+        return
     try:
-        main()
-        return "✅ Script ran successfully."
+        if payment.is_paid():
+            fulfil_paid_order(payment)
     except Exception as e:
-        return f"❌ Script failed: {e}"
+        state_store.finish_payment(payment_id, payment.status, str(e))
+        raise
+    state_store.finish_payment(payment_id, payment.status)
+
+def find_order_record(payment):
+    # Payments carry their roll's record id, so the record is a point read.
+    # Payments created before that, or whose roll has since been given a
+    # newer payment, fall back to searching on {Mollie ID}.
+    record_id = (payment.metadata or {}).get("record_id")
+    if record_id:
+        response = airtable.get(record_id)
+        if response.status_code == 200:
+            record = response.json()
+            airtable_record_cache.put_record(record)
+            if record["fields"].get("Mollie ID") == payment.id:
+                return record
+    formula = f"{{Mollie ID}}='{payment.id}'"
+    response = airtable.get(params={"filterByFormula": formula})
+    records = response.json().get("records", [])
+    return records[0] if records else None
 
-@app.route('/roll/<sticker>', methods=['GET', 'POST'])
-def gallery(sticker):
-    record = find_airtable_record(sticker)
+def fulfil_paid_order(payment):
+    # Marks the order paid and sends the customer and lab emails.
+    record = find_order_record(payment)
     if not record:
-        return "Roll not found.", 404
+        # The order is stored right after the payment is created, so this
+        # can be a race; raising lets the queue retry.
+        raise LookupError(f"No print order for payment {payment.id}")
+
+    fields = record["fields"]
+    sticker = fields.get("Twin Sticker")
+    client_email = fields.get("Client Email")
+    client_name = fields.get("Client Name", "Client")
+    folder = roll_folder_index.lookup(str(sticker)) if sticker else None
+    submitted_order = resolve_order_frames(folder, load_print_order(fields.get("Print Order JSON")), keep_unknown=True)
+
+    # Mark as Paid; nothing is sent until that has stuck.
+    if not update_airtable_record(record['id'], {"Print Order Paid": True}):
+        raise RuntimeError(f"Print Order Paid not saved for {record['id']}")
+
+    # Calculate pricing breakdown
+    submitted_order, type_counter, total = price_order(submitted_order, fields.get("Size", ""))
+    tax = vat_part(total)
+
+    # Compose customer email
+    email_body = f"""
+    <div style='text-align: center;'>
+      <img src='{LOGO_URL}' style='max-width: 200px; margin-bottom: 20px;'>
+    </div>
+    <div style='font-family: Helvetica, sans-serif; font-size: 16px;'>
+    <p>Hi there,</p>
+    <p>Thank you for your print order. Here’s a summary of what you selected for roll <strong>{sticker}</strong>:</p>
+    <ul>
+    """
+    for item in submitted_order:
+        image = f"<img src='{item['thumb_url']}' width='100'><br>" if item['thumb_url'] else ""
+        email_body += f"<li>{image}{item['size']} – {item['paper']}, Include Scan Border: {item['border']}</li>"
+    email_body += "</ul>"
+    email_body += f"<p><strong>Delivery Method:</strong> {fields.get('Delivery Method', 'N/A')}</p>"
+    email_body += "<p><strong>Order Breakdown:</strong></p><ul>"
+    for type, count in type_counter.items():
+        email_body += f"<li>{count} × {type}</li>"
+    email_body += f"</ul><p>Subtotal (excl. VAT): €{total - tax:.2f}<br>VAT ({VAT_RATE:.0%}): €{tax:.2f}<br><strong>Total: €{total:.2f}</strong></p>"
+    email_body += "<p>The order was successfully paid through Mollie.</p><p>We’ll start printing soon!<br>We'll notify you when your prints are ready for pickup at the lab or your drop-off point.</p></div>"
 
+    msg = EmailMessage()
+    msg["From"] = "Gil Plaquet FilmLab <filmlab@gilplaquet.com>"
+    msg["To"] = client_email
+    msg["Bcc"] = "filmlab@gilplaquet.com"
+    msg["Subject"] = f"Print Order Confirmation – Roll {sticker}"
+    msg.set_content("Your order is confirmed.")
+    msg.add_alternative(f"<html><body>{email_body}</body></html>", subtype="html")
+    mail_queue.enqueue(msg)
+
+    # Internal notification email
+    internal_msg = EmailMessage()
+    internal_msg["From"] = "Gil Plaquet FilmLab <filmlab@gilplaquet.com>"
+    internal_msg["To"] = "filmlab@gilplaquet.com"
+    internal_msg["Subject"] = f"A new print order for roll {sticker}"
+
+    internal_body = f"<h3>Roll {sticker} – Print Order Summary</h3><ul>"
+    for item in submitted_order:
+        image = f"<br><img src='{item['thumb_url']}' width='100'>" if item['thumb_url'] else ""
+        internal_body += (
+            f"<li><strong>{order_frame_label(item)}</strong><br>"
+            f"{item['size']} – {item['paper']}, Border: {item['border']}{image}</li>"
+        )
+    internal_body += "</ul>"
+
+    internal_msg.set_content("New print order received.")
+    internal_msg.add_alternative(f"<html><body>{internal_body}</body></html>", subtype="html")
+    mail_queue.enqueue(internal_msg)
+
+webhook_queue = WebhookQueue()
+atexit.register(webhook_queue.drain)
+
+# === Roll Access ===
+def password_error(record):
+    # Returns an error response if the roll's password can't be used at all.
     expected_password = record['fields'].get("Password")
     updated_time = record['fields'].get("Password Updated")
 
@@ -263,241 +2499,94 @@ def gallery(sticker):
             return "Password expired.", 403
     except Exception as e:
         return f"Invalid password timestamp format: {e}", 403
-
-    if session.get(f"access_{sticker}") == expected_password:
-        password_ok = True
-    elif request.method == "POST" and request.form.get("password") == expected_password:
+    return None
+
+def has_roll_access(sticker, record):
+    return session.get(f"access_{sticker}") == record['fields'].get("Password")
+
+def order_access_error(sticker, record):
+    # The order steps sign URLs for whatever frame ids are posted, so they
+    # need the same access as the gallery.
+    error = password_error(record)
+    if error:
+        return error
+    if not has_roll_access(sticker, record):
+        return "Password required.", 403
+    return None
+
+def check_roll_password(sticker, record):
+    # Session access, or a correct password posted from the password page.
+    expected_password = record['fields'].get("Password")
+    if has_roll_access(sticker, record):
+        return True
+    if request.method == "POST" and request.form.get("password") == expected_password:
         session[f"access_{sticker}"] = expected_password
-        password_ok = True
-    else:
-        password_ok = False
-
-    if not password_ok:
-        return render_template_string("""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-          <meta charset="UTF-8">
-          <meta name="viewport" content="width=device-width, initial-scale=1.0">
-          <title>Enter Password – Roll {{ sticker }}</title>
-          <style>
-            body {
-              font-family: 'Helvetica Neue', Helvetica, Arial, sans-serif;
-              background-color: #ffffff;
-              color: #333333;
-              margin: 0;
-              padding: 0;
-              text-align: center;
-            }
-            .container {
-              max-width: 400px;
-              margin: 100px auto;
-              padding: 20px;
-              border: 1px solid #ddd;
-              border-radius: 8px;
-              text-align: center;
-            }
-            img {
-              max-width: 200px;
-              height: auto;
-              margin-bottom: 20px;
-            }
-            h2 {
-              font-size: 1.5em;
-              margin-bottom: 1em;
-            }
-            input[type="password"] {
-              width: 100%;
-              padding: 10px;
-              font-size: 1em;
-              margin-bottom: 1em;
-              border: 1px solid #ccc;
-              border-radius: 4px;
-            }
-            button {
-              padding: 10px 20px;
-              font-size: 1em;
-              border: 2px solid #333;
-              border-radius: 4px;
-              background-color: #fff;
-              color: #333;
-              cursor: pointer;
-              transition: background-color 0.3s ease, color 0.3s ease;
-            }
-            button:hover {
-              background-color: #333;
-              color: #fff;
-            }
-          </style>
-        </head>
-        <body>
-          <div class="container">
-            <img src="https://cdn.sumup.store/shops/06666267/settings/th480/b23c5cae-b59a-41f7-a55e-1b145f750153.png" alt="Logo">
-            <h2>Enter password to access Roll {{ sticker }}</h2>
-            <form method="POST" style="display: flex; flex-direction: column; align-items: center; gap: 16px;">
-              <input type="password" name="password" placeholder="Password" required style="width: 100%; max-width: 300px; padding: 10px; font-size: 1em; border: 1px solid #ccc; border-radius: 4px;">
-              <button type="submit">Submit</button>
-            </form>
-          </div>
-        </body>
-        </html>
-        """, sticker=sticker)
-
-    def find_folder_by_suffix(suffix):
-        folders = list_roll_folders()
-        for name in folders:
-            if name.endswith(suffix.zfill(6)):
-                return name
-        return None
+        return True
+    return False
+
+# === Flask Routes ===
+@app.route('/')
+def index():
+    return "🟢 Render is online."
 
-    folder = find_folder_by_suffix(sticker)
+@app.route('/trigger')
+def trigger():
+    if request.args.get("token") != TRIGGER_TOKEN:
+        return "❌ Unauthorized", 403
+    job, created = submit_trigger_job(full_scan=request.args.get("full") == "1")
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "coalesced": not created,
+        "status_url": url_for('trigger_status', job_id=job.id),
+    }), 202
+
+@app.route('/trigger/status/<job_id>')
+def trigger_status(job_id):
+    if request.args.get("token") != TRIGGER_TOKEN:
+        return "❌ Unauthorized", 403
+    job = get_trigger_job(job_id)
+    if not job:
+        return "Job not found.", 404
+    return jsonify(job.to_dict())
+
+@app.route('/roll/<sticker>', methods=['GET', 'POST'])
+def gallery(sticker):
+    record = find_airtable_record(sticker)
+    if not record:
+        return "Roll not found.", 404
+
+    error = password_error(record)
+    if error:
+        return error
+
+    if not check_roll_password(sticker, record):
+        return render_template(TEMPLATES["password"], sticker=sticker)
+
+    folder = roll_folder_index.lookup(sticker)
     if not folder:
         return f"No folder found for sticker {sticker}.", 404
 
-    prefix = f"rolls/{folder}/"
-    s3 = boto3.client(
-        's3',
-        aws_access_key_id=S3_ACCESS_KEY_ID,
-        aws_secret_access_key=S3_SECRET_ACCESS_KEY,
-        endpoint_url=S3_ENDPOINT_URL,
-        config=Config(signature_version='s3v4')
-    )
-    result = s3.list_objects_v2(Bucket=B2_BUCKET_NAME, Prefix=prefix)
-    image_files = [obj["Key"] for obj in result.get("Contents", []) if obj["Key"].lower().endswith(('.jpg', '.jpeg', '.png'))]
-    image_urls = [generate_signed_url(f) for f in image_files]
-    zip_url = generate_signed_url(f"{prefix}{sticker}.zip")
-
+    zip_state = roll_zip_state(folder)
+    zip_url = generate_signed_url(roll_zip_key(folder)) if zip_state == "ready" else None
     comment = record['fields'].get('Comment', '').strip()
-
-    return render_template_string("""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-      <meta charset="UTF-8">
-      <meta name="viewport" content="width=device-width, initial-scale=1.0">
-      <title>Roll {{ sticker }} – Gil Plaquet FilmLab</title>
-      <style>
-        body {
-          font-family: 'Helvetica Neue', Helvetica, Arial, sans-serif;
-          background-color: #ffffff;
-          color: #333333;
-          margin: 0;
-          padding: 0;
-          text-align: center;
-        }
-        .container {
-          max-width: 960px;
-          margin: 0 auto;
-          padding: 40px 20px;
-        }
-        h1 {
-          font-size: 2em;
-          margin-bottom: 0.5em;
-        }
-        .gallery {
-          display: flex;
-          flex-wrap: wrap;
-          justify-content: center;
-          gap: 10px;
-          margin-top: 30px;
-        }
-        .gallery-item {
-          width: 260px;
-          height: 260px;
-          background-color: #f8f8f8;
-          border-radius: 8px;
-          overflow: hidden;
-          display: flex;
-          align-items: center;
-          justify-content: center;
-          box-shadow: 0 2px 8px rgba(0, 0, 0, 0.1);
-        }
-        .gallery-item img {
-          max-width: 100%;
-          max-height: 100%;
-          object-fit: contain;
-          display: block;
-        }
-        .download {
-          display: inline-block;
-          margin-bottom: 30px;
-          padding: 12px 24px;
-          border: 2px solid #333333;
-          border-radius: 4px;
-          text-decoration: none;
-          color: #333333;
-          font-weight: bold;
-          transition: background-color 0.3s ease, color 0.3s ease;
-        }
-        .download:hover {
-          background-color: #333333;
-          color: #ffffff;
-        }
-        footer {
-          margin-top: 60px;
-          font-size: 0.9em;
-          color: #888888;
-        }
-        .roll-info {
-          font-size: 1.1em;
-          margin: 20px 0;
-          line-height: 1.6;
-        }
-        .roll-info span {
-          display: block;
-        }
-        @media (min-width: 600px) {
-          .roll-info span {
-            display: inline;
-          }
-          .roll-info span:not(:last-child)::after {
-            content: " – ";
-          }
-        }
-      </style>
-    </head>
-    <body>
-      <div class="container">
-        <div>
-          <img src="https://cdn.sumup.store/shops/06666267/settings/th480/b23c5cae-b59a-41f7-a55e-1b145f750153.png" alt="Logo" style="max-width: 200px; height: auto; margin-bottom: 20px;">
-        </div>
-        <a class="download" href="{{ zip_url }}">Download All (ZIP)</a>
-        <a class="download" href="/roll/{{ sticker }}/order">Order Prints</a>
-        <div class="roll-info">
-          <span><strong>Roll:</strong> {{ sticker }}</span>
-          {% if record['fields'].get('Size') %}
-            <span><strong>Size:</strong> {{ record['fields']['Size'] }}</span>
-          {% endif %}
-          {% if record['fields'].get('Stock') %}
-            <span><strong>Film Stock:</strong> {{ record['fields']['Stock'][0] }}</span>
-          {% endif %}
-          {% if record['fields'].get('Scan') %}
-            <span><strong>Scan:</strong> {{ record['fields']['Scan'] }}</span>
-          {% endif %}
-          {% if comment %}
-            <br><span><strong>Comment:</strong> {{ comment }}</span>
-          {% endif %}
-        </div>
-        <div class="gallery">
-          {% for url in image_urls %}
-            <div class="gallery-item">
-              <img src="{{ url }}" alt="Scan {{ loop.index }}">
-            </div>
-          {% endfor %}
-        </div>    
-        <footer>
-          &copy; {{ current_year }} Gil Plaquet
-        </footer>
-      </div>
-    </body>
-    </html>
-    """, 
-    sticker=sticker, 
-    image_urls=image_urls, 
-    zip_url=zip_url, 
-    current_year=datetime.now().year,
-    record=record,
-    comment=comment
+    context = dict(
+        sticker=sticker,
+        images=RollImagePage(folder, GALLERY_PAGE_SIZE),
+        zip_state=zip_state,
+        zip_url=zip_url,
+        current_year=datetime.now().year,
+        record=record,
+        comment=comment
+    )
+    if not GALLERY_STREAMING:
+        return render_template(TEMPLATES["gallery"], **context)
+    # Header, roll info and buttons go out before the bucket is listed; tiles
+    # follow as each URL is signed. X-Accel-Buffering stops proxies holding
+    # the body back.
+    return app.response_class(
+        stream_template(TEMPLATES["gallery"], **context),
+        headers={"X-Accel-Buffering": "no"}
     )
 
 @app.route('/roll/<sticker>/order', methods=['GET', 'POST'])
@@ -506,68 +2595,22 @@ def order_page(sticker):
     if not record:
         return "Roll not found.", 404
 
-    expected_password = record['fields'].get("Password")
-    updated_time = record['fields'].get("Password Updated")
-
-    if not expected_password or not updated_time:
-        return "Missing password data.", 403
-
-    try:
-        password_age = (datetime.utcnow() - datetime.strptime(updated_time, "%Y-%m-%dT%H:%M:%S.%fZ")).total_seconds()
-        if password_age > 604800:
-            return "Password expired.", 403
-    except Exception as e:
-        return f"Invalid password timestamp format: {e}", 403
+    error = password_error(record)
+    if error:
+        return error
 
-    if session.get(f"access_{sticker}") == expected_password:
-        password_ok = True
-    elif request.method == "POST" and request.form.get("password") == expected_password:
-        session[f"access_{sticker}"] = expected_password
-        password_ok = True
-    else:
-        password_ok = False
-
-    if not password_ok:
-        return render_template_string("""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head><meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Enter Password – Roll {{ sticker }}</title>
-        <style>body { font-family: Helvetica; text-align: center; margin-top: 100px; }
-        input, button { padding: 10px; font-size: 1em; margin-top: 10px; }</style>
-        </head>
-        <body>
-          <h2>Enter password to access Roll {{ sticker }}</h2>
-          <form method="POST">
-            <input type="password" name="password" placeholder="Password" required>
-            <br>
-            <button type="submit">Submit</button>
-          </form>
-        </body></html>
-        """, sticker=sticker)
-
-    def find_folder_by_suffix(suffix):
-        folders = list_roll_folders()
-        for name in folders:
-            if name.endswith(suffix.zfill(6)):
-                return name
-        return None
+    if not check_roll_password(sticker, record):
+        return render_template(TEMPLATES["password"], sticker=sticker)
 
-    folder = find_folder_by_suffix(sticker)
+    folder = roll_folder_index.lookup(sticker)
     if not folder:
         return f"No folder found for sticker {sticker}.", 404
 
-    prefix = f"rolls/{folder}/"
-    s3 = boto3.client(
-        's3',
-        aws_access_key_id=S3_ACCESS_KEY_ID,
-        aws_secret_access_key=S3_SECRET_ACCESS_KEY,
-        endpoint_url=S3_ENDPOINT_URL,
-        config=Config(signature_version='s3v4')
-    )
-    result = s3.list_objects_v2(Bucket=B2_BUCKET_NAME, Prefix=prefix)
-    image_files = [obj["Key"] for obj in result.get("Contents", []) if obj["Key"].lower().endswith(('.jpg', '.jpeg', '.png'))]
-    image_urls = [generate_signed_url(f) for f in image_files]
+    frames = load_roll_frames(folder)
+    if frames.missing_derivatives():
+        schedule_roll_derivatives(folder)
+    images = build_image_entries(frames.keys[:GALLERY_PAGE_SIZE], frames)
+    next_cursor = GALLERY_PAGE_SIZE if len(frames) > GALLERY_PAGE_SIZE else None
 
     film_size = record['fields'].get("Size", "")
     scan_type = record['fields'].get("Scan", "")
@@ -575,104 +2618,13 @@ def order_page(sticker):
     is_half_frame = film_size == "Half Frame"
     is_standard_35mm = film_size == "35mm"
 
-    show_whole_roll_buttons = (is_standard_35mm and len(image_urls) >= 20) or (is_half_frame and len(image_urls) >= 20)
+    show_whole_roll_buttons = (is_standard_35mm and len(frames) >= 20) or (is_half_frame and len(frames) >= 20)
     show_select_all_button = not show_whole_roll_buttons
     allow_border_option = "Hires" in scan_type
     roll_label = "Half-Frame Roll" if is_half_frame else "Whole Roll"
-    price_cap = "€25" if is_half_frame else "€15"
-
-    return render_template_string("""
-<!DOCTYPE html>
-<html><head><meta charset="UTF-8">
-<title>Select Prints – Roll {{ sticker }}</title>
-<style>
-body { font-family: Helvetica; background-color: #fff; color: #333; margin: 0; padding: 0; }
-.container { max-width: 1280px; margin: auto; padding: 40px 20px; text-align: center; }
-.grid { display: grid; grid-template-columns: repeat(auto-fit, minmax(280px, 1fr)); gap: 12px; }
-.grid-item { border: 1px solid #eee; border-radius: 6px; padding: 8px; }
-.grid-item img { height: 150px; width: auto; display: block; margin: 0 auto 8px auto; object-fit: contain; }
-.button-row { display: flex; flex-wrap: wrap; justify-content: center; gap: 10px; margin-bottom: 20px; }
-button { padding: 10px 18px; font-size: 0.95em; border: 2px solid #333; background: #fff; color: #333; cursor: pointer; border-radius: 4px; }
-button:disabled { opacity: 0.4; cursor: not-allowed; }
-button:hover:enabled { background: #333; color: #fff; }
-.note { font-size: 0.95em; margin-top: 10px; color: #666; }
-.download { display: inline-block; margin-bottom: 20px; padding: 10px 16px; border: 2px solid #333; border-radius: 4px; text-decoration: none; color: #333; }
-.download:hover { background-color: #333; color: #fff; }
-</style>
-<script>
-function submitWholeRoll(paperType) {
-  const isHalfFrame = {{ 'true' if is_half_frame else 'false' }};
-  const priceCap = isHalfFrame ? 25 : 15;
-  const label = isHalfFrame ? "half-frame roll" : "roll";
-  if (!confirm(`This will print the entire ${label} on 10x15 ${paperType} paper. Each print normally costs €0.75. As you've selected 20 or more prints, the total is capped at €${priceCap}. Continue?`)) return;
-
-  const form = document.createElement('form');
-  form.method = 'POST';
-  form.action = `/roll/{{ sticker }}/submit-order`;
-  document.querySelectorAll('input[name="selected_images"]').forEach((cb, i) => {
-    const url = cb.value;
-    form.innerHTML += `<input type="hidden" name="order[${i}][url]" value="${url}">`;
-    form.innerHTML += `<input type="hidden" name="order[${i}][size]" value="10x15">`;
-    form.innerHTML += `<input type="hidden" name="order[${i}][paper]" value="${paperType}">`;
-    form.innerHTML += `<input type="hidden" name="order[${i}][border]" value="No">`;
-  });
-  document.body.appendChild(form); form.submit();
-}
+    price_cap = f"€{PRICE_CAPS['Half Frame' if is_half_frame else '35mm']['cap']:g}"
 
-function selectAllImages() {
-  document.querySelectorAll('input[name="selected_images"]').forEach(cb => cb.checked = true);
-  updateSubmitState();
-}
-function deselectAllImages() {
-  document.querySelectorAll('input[name="selected_images"]').forEach(cb => cb.checked = false);
-  updateSubmitState();
-}
-function updateSubmitState() {
-  const count = document.querySelectorAll('input[name="selected_images"]:checked').length;
-  document.getElementById('nextButton').disabled = count === 0;
-  const topBtn = document.getElementById('topOrderButton');
-  if (topBtn) topBtn.disabled = count === 0;
-}
-document.addEventListener('DOMContentLoaded', () => {
-  document.querySelectorAll('input[name="selected_images"]').forEach(input => {
-    input.addEventListener('change', updateSubmitState);
-  });
-  updateSubmitState();
-});
-</script></head><body>
-<div class="container">
-  <div><img src="https://cdn.sumup.store/shops/06666267/settings/th480/b23c5cae-b59a-41f7-a55e-1b145f750153.png" alt="Logo" style="max-width: 200px; margin-bottom: 20px;"></div>
-  <a class="download" href="/roll/{{ sticker }}">&larr; Back to Gallery</a>
-  <form method="POST" action="/roll/{{ sticker }}/submit-order">
-    <div class="button-row">
-      {% if show_whole_roll_buttons %}
-        <button type="button" onclick="submitWholeRoll('Matte')">Print {{ roll_label }} on 10x15 Matte ({{ price_cap }})</button>
-        <button type="button" onclick="submitWholeRoll('Glossy')">Print {{ roll_label }} on 10x15 Glossy ({{ price_cap }})</button>
-        <button type="button" onclick="submitWholeRoll('Luster')">Print {{ roll_label }} on 10x15 Luster ({{ price_cap }})</button>
-      {% elif show_select_all_button %}
-        <button type="button" onclick="selectAllImages()">Select All</button>
-        <button type="button" onclick="deselectAllImages()">Deselect All</button>
-      {% endif %}
-      <button type="submit" id="topOrderButton">Order Selected Prints</button>
-    </div>
-    <p class="note">Select your prints below</p>
-    <div class="grid">
-      {% for url in image_urls %}
-      <div class="grid-item">
-        <label style="cursor: pointer; display: block;">
-          <img src="{{ url }}" alt="Scan {{ loop.index }}">
-          <input type="checkbox" name="selected_images" value="{{ url }}" style="margin-top: 6px;">
-        </label>
-      </div>
-      {% endfor %}
-    </div>
-    <div style="margin: 40px 0;"></div>
-    <button id="nextButton" type="submit">Order Selected Prints</button>
-  </form>
-</div>
-</body>
-</html>
-    """, sticker=sticker, image_urls=image_urls,
+    return render_template(TEMPLATES["order"], sticker=sticker, images=images, next_cursor=next_cursor,
        show_whole_roll_buttons=show_whole_roll_buttons,
        show_select_all_button=show_select_all_button,
        allow_border_option=allow_border_option,
@@ -680,216 +2632,114 @@ document.addEventListener('DOMContentLoaded', () => {
        roll_label=roll_label,
        price_cap=price_cap)
 
+@app.route('/roll/<sticker>/images')
+def roll_images(sticker):
+    record = find_airtable_record(sticker)
+    if not record:
+        return jsonify({"error": "Roll not found."}), 404
+
+    error = password_error(record)
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+    if not has_roll_access(sticker, record):
+        return jsonify({"error": "Password required."}), 403
+
+    folder = roll_folder_index.lookup(sticker)
+    if not folder:
+        return jsonify({"error": f"No folder found for sticker {sticker}."}), 404
+
+    try:
+        cursor = max(0, int(request.args.get("cursor", 0)))
+        limit = min(max(1, int(request.args.get("limit", GALLERY_PAGE_SIZE))), 200)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor."}), 400
+
+    frames = load_roll_frames(folder)
+    page = build_image_entries(frames.keys[cursor:cursor + limit], frames)
+    next_cursor = cursor + limit if cursor + limit < len(frames) else None
+    return jsonify({
+        "images": [
+            {"index": cursor + i + 1, "frame": entry["frame"], "number": entry["number"], "url": entry["url"], "thumb_url": entry["thumb_url"], "preview_url": entry["preview_url"]}
+            for i, entry in enumerate(page)
+        ],
+        "next_cursor": str(next_cursor) if next_cursor is not None else None,
+        "total": len(frames),
+    })
+
+@app.route('/roll/<sticker>/download.zip', methods=['GET', 'POST'])
+def download_zip(sticker):
+    # Streams the zip as it's assembled, for when the prebuilt one isn't
+    # there yet (or at all).
+    record = find_airtable_record(sticker)
+    if not record:
+        return "Roll not found.", 404
+
+    error = password_error(record)
+    if error:
+        return error
+
+    if not check_roll_password(sticker, record):
+        return render_template(TEMPLATES["password"], sticker=sticker)
+
+    folder = roll_folder_index.lookup(sticker)
+    if not folder:
+        return f"No folder found for sticker {sticker}.", 404
+
+    objects = list_roll_originals(folder)
+    if not objects:
+        return "No images in this roll yet.", 404
+    return app.response_class(
+        stream_roll_zip(folder, objects),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{sticker}.zip"', "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/roll/<sticker>/zip')
+def roll_zip(sticker):
+    # Polled by the gallery while the zip is being prepared.
+    record = find_airtable_record(sticker)
+    if not record:
+        return jsonify({"error": "Roll not found."}), 404
+
+    error = password_error(record)
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+    if not has_roll_access(sticker, record):
+        return jsonify({"error": "Password required."}), 403
+
+    folder = roll_folder_index.lookup(sticker)
+    if not folder:
+        return jsonify({"error": f"No folder found for sticker {sticker}."}), 404
+
+    state = roll_zip_state(folder)
+    return jsonify({
+        "state": state,
+        "url": generate_signed_url(roll_zip_key(folder)) if state == "ready" else None,
+    })
+
 @app.route('/roll/<sticker>/submit-order', methods=['POST'])
 def submit_order(sticker):
     record = find_airtable_record(sticker)
     if not record:
         return "Roll not found.", 404
 
+    error = order_access_error(sticker, record)
+    if error:
+        return error
+
     scan_level = record['fields'].get('Scan', '')
     allow_border_option = 'Hires' in scan_level
 
-    submitted_order = []
-    if 'order[0][url]' in request.form:
-        for key in request.form:
-            if key.startswith('order[') and key.endswith('][url]'):
-                index = key.split('[')[1].split(']')[0]
-                submitted_order.append({
-                    'url': request.form.get(f'order[{index}][url]'),
-                    'size': request.form.get(f'order[{index}][size]', '10x15'),
-                    'paper': request.form.get(f'order[{index}][paper]', 'Glossy'),
-                    'border': request.form.get(f'order[{index}][border]', 'No')
-                })
-    else:
-        urls = request.form.getlist("selected_images")
-        for url in urls:
-            submitted_order.append({
-                'url': url,
-                'size': '10x15',
-                'paper': 'Glossy',
-                'border': 'No'
-            })
+    submitted_order = read_order_form(request.form)
+    if not submitted_order:
+        for frame in request.form.getlist("selected_images"):
+            submitted_order.append({'frame': frame_from_url(frame) if "://" in frame else frame, **ORDER_DEFAULTS})
+    submitted_order = resolve_order_frames(roll_folder_index.lookup(sticker), submitted_order)
 
     if not submitted_order:
         return "No images selected.", 400
 
-    return render_template_string("""
-    <!DOCTYPE html>
-    <html>
-    <head>
-      <meta charset="UTF-8">
-      <title>Confirm Order – Roll {{ sticker }}</title>
-      <script>
-        const rollSize = "{{ record['fields'].get('Size', '') }}";
-      </script>
-      <style>
-        body { font-family: Helvetica, sans-serif; background: #fff; color: #333; margin: 0; padding: 0; }
-        .container { max-width: 960px; margin: 0 auto; padding: 40px 20px; text-align: center; }
-        .controls { display: flex; justify-content: center; flex-wrap: wrap; gap: 12px; margin-bottom: 30px; }
-        .grid { display: grid; grid-template-columns: repeat(auto-fit, minmax(280px, 1fr)); gap: 12px; margin-bottom: 40px; }
-        .grid-item { border: 1px solid #ccc; border-radius: 6px; padding: 12px; text-align: center; }
-        .grid-item img { max-height: 180px; width: auto; margin-bottom: 10px; }
-        .selectors { display: flex; justify-content: center; gap: 8px; flex-wrap: wrap; margin-bottom: 8px; }
-        .price-tag { font-size: 0.95em; color: #555; margin-top: 4px; }
-        select { padding: 4px 6px; font-size: 0.95em; }
-        .actions { margin: 20px 0; display: flex; flex-wrap: wrap; justify-content: center; gap: 10px; }
-        .total-price { font-size: 1.2em; margin-top: 10px; }
-        button, .button-link {
-          padding: 10px 20px;
-          font-size: 1em;
-          border: 2px solid #333;
-          border-radius: 4px;
-          background: #fff;
-          color: #333;
-          cursor: pointer;
-          text-decoration: none;
-        }
-        button:hover, .button-link:hover {
-          background: #333;
-          color: #fff;
-        }
-      </style>
-      <script>
-        function applyToAll() {
-          const size = document.getElementById('applySize').value;
-          const paper = document.getElementById('applyPaper').value;
-          const border = document.getElementById('applyBorder')?.value;
-          document.querySelectorAll('[data-row]').forEach(row => {
-            if (size !== '—') row.querySelector('.size').value = size;
-            if (paper !== '—') row.querySelector('.paper').value = paper;
-            if (border !== undefined && border !== '—') row.querySelector('.border').value = border;
-            updatePrice(row);
-          });
-          updateTotal();
-        }
-
-        function getPrice(size) {
-          if (size === '10x15') return 0.75;
-          if (size === 'A6') return 1.5;
-          if (size === 'A5') return 3.0;
-          if (size === 'A4') return 6.0;
-          if (size === 'A3') return 12.0;
-          return 0;
-        }
-
-        function updatePrice(row) {
-          const size = row.querySelector('.size').value;
-          const price = getPrice(size);
-          row.querySelector('.price-tag').textContent = `€${price.toFixed(2)}`;
-        }
-
-        function updateTotal() {
-          let total = 0;
-          let count_10x15 = 0;
-          const totalItems = document.querySelectorAll('[data-row]').length;
-          document.querySelectorAll('[data-row]').forEach(row => {
-            const size = row.querySelector('.size').value;
-            const price = getPrice(size);
-            total += price;
-            if (size === '10x15') count_10x15 += 1;
-          });
-          if (count_10x15 === totalItems) {
-            if (rollSize === 'Half Frame') {
-              total = Math.min(total, 25);
-            } else if (rollSize === '35mm' && count_10x15 >= 20) {
-              total = Math.min(total, 15);
-            }
-          }
-          document.getElementById('totalDisplay').textContent = `Your order total is €${total.toFixed(2)}`;
-        }
-
-        document.addEventListener('DOMContentLoaded', () => {
-          document.querySelectorAll('[data-row]').forEach(row => {
-            row.querySelectorAll('select').forEach(sel => {
-              sel.addEventListener('change', () => {
-                updatePrice(row);
-                updateTotal();
-              });
-            });
-            updatePrice(row);
-          });
-          updateTotal();
-        });
-      </script>
-    </head>
-    <body>
-      <div class="container">
-        <div><img src="https://cdn.sumup.store/shops/06666267/settings/th480/b23c5cae-b59a-41f7-a55e-1b145f750153.png" alt="Logo" style="max-width: 200px; margin-bottom: 20px;"></div>
-        <h1>Confirm Your Print Order – Roll {{ sticker }}</h1>
-        <p class="total-price" id="totalDisplay">Your order total is €0.00</p>
-        <form method="POST" action="/roll/{{ sticker }}/review-order">
-          <div class="actions">
-            <a class="button-link" href="/roll/{{ sticker }}/order">← Back to Selection</a>
-            <button type="submit">Review & Pay</button>
-          </div>
-          <div class="controls">
-            <label>Size:
-              <select id="applySize">
-                <option>—</option>
-                <option>10x15</option>
-                <option>A6</option>
-                <option>A5</option>
-                <option>A4</option>
-                <option>A3</option>
-              </select>
-            </label>
-            <label>Paper:
-              <select id="applyPaper">
-                <option>—</option>
-                <option>Glossy</option>
-                <option>Matte</option>
-                <option>Luster</option>
-              </select>
-            </label>
-            {% if allow_border_option %}
-            <label>Scan Border:
-              <select id="applyBorder">
-                <option>—</option>
-                <option value="No">No Scan Border</option>
-                <option value="Yes">Print Scan Border</option>
-              </select>
-            </label>
-            {% endif %}
-            <button type="button" onclick="applyToAll()">Apply to All</button>
-          </div>
-          <div class="grid">
-            {% for item in submitted_order %}
-              <div class="grid-item" data-row>
-                <img src="{{ item.url }}">
-                <div class="selectors">
-                  <select name="order[{{ loop.index0 }}][size]" class="size">
-                    <option {% if item.size == '10x15' %}selected{% endif %}>10x15</option>
-                    <option {% if item.size == 'A6' %}selected{% endif %}>A6</option>
-                    <option {% if item.size == 'A5' %}selected{% endif %}>A5</option>
-                    <option {% if item.size == 'A4' %}selected{% endif %}>A4</option>
-                    <option {% if item.size == 'A3' %}selected{% endif %}>A3</option>
-                  </select>
-                  <select name="order[{{ loop.index0 }}][paper]" class="paper">
-                    <option {% if item.paper == 'Glossy' %}selected{% endif %}>Glossy</option>
-                    <option {% if item.paper == 'Matte' %}selected{% endif %}>Matte</option>
-                    <option {% if item.paper == 'Luster' %}selected{% endif %}>Luster</option>
-                  </select>
-                  {% if allow_border_option %}
-                  <select name="order[{{ loop.index0 }}][border]" class="border">
-                    <option value="No" {% if item.border == 'No' %}selected{% endif %}>No Scan Border</option>
-                    <option value="Yes" {% if item.border == 'Yes' %}selected{% endif %}>Print Scan Border</option>
-                  </select>
-                  {% else %}
-                  <input type="hidden" name="order[{{ loop.index0 }}][border]" value="No">
-                  {% endif %}
-                </div>
-                <div class="price-tag">€0.00</div>
-                <input type="hidden" name="order[{{ loop.index0 }}][url]" value="{{ item.url }}">
-              </div>
-            {% endfor %}
-          </div>
-          <div style="margin-bottom: 40px;"></div>
-          <button type="submit">Review & Pay</button>
-        </form>
-      </div>
-    </body>
-    </html>
-    """, sticker=sticker, submitted_order=submitted_order, allow_border_option=allow_border_option, record=record)
+    return render_template(TEMPLATES["confirm_order"], sticker=sticker, submitted_order=submitted_order, allow_border_option=allow_border_option, record=record)
 
 @app.route('/roll/<sticker>/review-order', methods=['POST'])
 def review_order(sticker):
@@ -897,244 +2747,48 @@ def review_order(sticker):
     if not record:
         return "Roll not found.", 404
 
+    error = order_access_error(sticker, record)
+    if error:
+        return error
+
     scan_quality = record['fields'].get('Scan', '')
     allow_border = 'Hires' in scan_quality
 
-    submitted_order = []
-    type_counter = {}
-    subtotal = 0.0
-    tax_rate = 0.21
-    count_10x15 = 0
+    items = resolve_order_frames(roll_folder_index.lookup(sticker), read_order_form(request.form))
+    submitted_order, type_counter, total = price_order(items, record['fields'].get('Size', ''))
+    tax = vat_part(total)
 
-    for key in request.form:
-        if key.startswith('order[') and key.endswith('][url]'):
-            index = key.split('[')[1].split(']')[0]
-            url = request.form.get(f'order[{index}][url]')
-            size = request.form.get(f'order[{index}][size]', '10x15')
-            paper = request.form.get(f'order[{index}][paper]', 'Glossy')
-            border = request.form.get(f'order[{index}][border]', 'No')
-
-            if size == '10x15':
-                count_10x15 += 1
-                price = 0.75
-            elif size == 'A6':
-                price = 1.5
-            elif size == 'A5':
-                price = 3.0
-            elif size == 'A4':
-                price = 6.0
-            elif size == 'A3':
-                price = 12.0
-            else:
-                price = 0.0
-
-            key_type = f"{size} - {paper}"
-            type_counter[key_type] = type_counter.get(key_type, 0) + 1
-            submitted_order.append({'url': url, 'size': size, 'paper': paper, 'border': border, 'price': price})
-            subtotal += price
-
-    # Apply cap logic
-    roll_size = record['fields'].get('Size', '')
-    if count_10x15 == len(submitted_order):  # Only 10x15 prints
-        if roll_size == 'Half Frame':
-            subtotal = min(subtotal, 25.0)
-        elif roll_size == '35mm' and count_10x15 >= 20:
-            subtotal = min(subtotal, 15.0)
-
-    tax = subtotal * tax_rate / (1 + tax_rate)
-    total = subtotal
-
-    return render_template_string("""
-<!DOCTYPE html>
-<html>
-<head>
-  <meta charset="UTF-8">
-  <title>Review Print Order – Roll {{ sticker }}</title>
-  <style>
-    body {
-      font-family: Helvetica, sans-serif;
-      background-color: #fff;
-      color: #333;
-      margin: 0;
-      padding: 0;
-    }
-    .container {
-      max-width: 960px;
-      margin: 0 auto;
-      padding: 40px 20px;
-      text-align: center;
-    }
-    .summary {
-      margin: 20px 0 30px 0;
-    }
-    .summary h2 {
-      margin-bottom: 10px;
-    }
-    .summary p {
-      margin: 4px 0;
-    }
-    .grid {
-      display: grid;
-      grid-template-columns: repeat(auto-fit, minmax(280px, 1fr));
-      gap: 12px;
-    }
-    .grid-item {
-      border: 1px solid #ccc;
-      border-radius: 6px;
-      padding: 10px;
-    }
-    .grid-item img {
-      height: 180px;
-      width: auto;
-      object-fit: contain;
-      display: block;
-      margin: 0 auto 10px auto;
-    }
-    .button-row {
-      margin-top: 20px;
-      display: flex;
-      justify-content: center;
-      gap: 10px;
-      flex-wrap: wrap;
-    }
-    .button-row button {
-      padding: 12px 24px;
-      font-size: 1em;
-      border: 2px solid #333;
-      border-radius: 4px;
-      background: #fff;
-      color: #333;
-      cursor: pointer;
-      transition: background 0.3s, color 0.3s;
-    }
-    .button-row button:hover,
-    .button-row button:active {
-      background: #333;
-      color: #fff;
-    }
-    .logo {
-      max-width: 200px;
-      margin: 20px auto 30px;
-      display: block;
-    }
-  </style>
-</head>
-<body>
-  <div class="container">
-    <div><img src="https://cdn.sumup.store/shops/06666267/settings/th480/b23c5cae-b59a-41f7-a55e-1b145f750153.png" alt="Logo" style="max-width: 200px; margin-bottom: 20px;"></div>
-    <h1>Review Your Print Order – Roll {{ sticker }}</h1>
-    <div class="summary">
-      <h2>Total: €{{ '%.2f'|format(total) }} (incl. VAT)</h2>
-      <form method="POST">
-        {% for item in submitted_order %}
-          <input type="hidden" name="order[{{ loop.index0 }}][url]" value="{{ item.url }}">
-          <input type="hidden" name="order[{{ loop.index0 }}][size]" value="{{ item.size }}">
-          <input type="hidden" name="order[{{ loop.index0 }}][paper]" value="{{ item.paper }}">
-          {% if allow_border %}
-            <input type="hidden" name="order[{{ loop.index0 }}][border]" value="{{ item.border }}">
-          {% endif %}
-        {% endfor %}
-        <div class="button-row">
-          <button type="submit" formaction="/roll/{{ sticker }}/submit-order">← Back to Edit</button>
-          <button type="submit" formaction="/roll/{{ sticker }}/finalize-order">Pay with Mollie</button>
-        </div>
-      </form>
-
-      <h3 style="margin-top:30px;">Order Breakdown:</h3>
-      {% for type, count in type_counter.items() %}
-        <p>{{ count }} × {{ type }}</p>
-      {% endfor %}
-      <p>Subtotal (excl. VAT): €{{ '%.2f'|format(total - tax) }}</p>
-      <p>VAT (21%): €{{ '%.2f'|format(tax) }}</p>
-    </div>
-    <div class="grid">
-      {% for item in submitted_order %}
-        <div class="grid-item">
-          <img src="{{ item.url }}">
-          <p>{{ item.size }} – {{ item.paper }}<br>€{{ '%.2f'|format(item.price) }}</p>
-        </div>
-      {% endfor %}
-    </div>
-  </div>
-</body>
-</html>
-""", sticker=sticker, submitted_order=submitted_order, total=total, tax=tax, type_counter=type_counter, allow_border=allow_border)
+    return render_template(TEMPLATES["review_order"], sticker=sticker, submitted_order=submitted_order, total=total, tax=tax, type_counter=type_counter, allow_border=allow_border)
 
 @app.route('/roll/<sticker>/finalize-order', methods=['POST'])
 def finalize_order(sticker):
-    from mollie.api.client import Client as MollieClient
-
     record = find_airtable_record(sticker)
     if not record:
         return "Roll not found.", 404
 
-    mollie_api_key = os.getenv("MOLLIE_API_KEY")
-    if not mollie_api_key:
-        return "Mollie API key not set.", 500
+    error = order_access_error(sticker, record)
+    if error:
+        return error
 
-    mollie_client = MollieClient()
-    mollie_client.set_api_key(mollie_api_key)
+    gateway = get_payment_gateway()
+    if gateway is None:
+        return "Mollie API key not set.", 500
 
-    submitted_order = []
-    total = 0.0
-    count_10x15 = 0
+    # Only the frame id and print options are stored, not the signed URLs.
+    items = resolve_order_frames(roll_folder_index.lookup(sticker), read_order_form(request.form))
+    submitted_order = [{field: item[field] for field in ORDER_FIELDS} for item in items]
+    if not submitted_order:
+        return "No images selected.", 400
 
-    for key in request.form:
-        if key.startswith('order[') and key.endswith('][url]'):
-            index = key.split('[')[1].split(']')[0]
-            url = request.form.get(f'order[{index}][url]')
-            size = request.form.get(f'order[{index}][size]', '10x15')
-            paper = request.form.get(f'order[{index}][paper]', 'Glossy')
-            border = request.form.get(f'order[{index}][border]', 'No')
-
-            submitted_order.append({
-                'url': url,
-                'size': size,
-                'paper': paper,
-                'border': border
-            })
-
-            if size == '10x15':
-                count_10x15 += 1
-                total += 0.75
-            elif size == 'A6':
-                total += 1.5
-            elif size == 'A5':
-                total += 3.0
-            elif size == 'A4':
-                total += 6.0
-            elif size == 'A3':
-                total += 12.0
-
-    roll_size = record['fields'].get('Size', '')
-
-    if count_10x15 == len(submitted_order):  # All prints are 10x15
-        if roll_size == 'Half Frame':
-            capped_total = min(total, 25.0)
-        elif roll_size == '35mm' and count_10x15 >= 20:
-            capped_total = min(total, 15.0)
-        else:
-            capped_total = total
-    else:
-        capped_total = total
+    capped_total = order_total((item['size'] for item in submitted_order), record['fields'].get('Size', ''))
 
     description = f"Print order for roll {sticker}"
     redirect_url = f"https://scans.gilplaquet.com/roll/{sticker}/thank-you"
     webhook_url = "https://scans.gilplaquet.com/mollie-webhook"
 
     try:
-        payment = mollie_client.payments.create({
-            "amount": {
-                "currency": "EUR",
-                "value": f"{capped_total:.2f}"
-            },
-            "description": description,
-            "redirectUrl": redirect_url,
-            "webhookUrl": webhook_url,
-            "metadata": {
-                "sticker": sticker
-            }
-        })
+        metadata = {"sticker": sticker, "record_id": record["id"]}
+        payment = gateway.create_payment(capped_total, description, redirect_url, webhook_url, metadata)
 
         store_print_order_in_roll(sticker, submitted_order, payment.id)
         return redirect(payment.checkout_url)
@@ -1152,197 +2806,39 @@ def thank_you(sticker):
     raw_email = fields.get('Client Email', 'your email')
     email = str(raw_email).strip('"').strip("'") if raw_email else 'your email'
 
-    return render_template_string(f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <title>Thank You – Roll {sticker}</title>
-        <style>
-            body {{
-                font-family: Helvetica, sans-serif;
-                background-color: #ffffff;
-                margin: 0;
-                padding: 0;
-                color: #333;
-                text-align: center;
-            }}
-            .wrapper {{
-                padding: 60px 20px;
-                max-width: 600px;
-                margin: auto;
-            }}
-            h1 {{
-                font-size: 2em;
-                margin-bottom: 20px;
-            }}
-            p {{
-                font-size: 1.1em;
-                margin-bottom: 20px;
-                line-height: 1.5;
-            }}
-            img {{
-                max-width: 200px;
-                margin-bottom: 30px;
-            }}
-            a.button {{
-                display: inline-block;
-                padding: 10px 20px;
-                font-size: 1em;
-                border: 2px solid #333;
-                border-radius: 4px;
-                background: #fff;
-                color: #333;
-                text-decoration: none;
-                margin-top: 30px;
-            }}
-            a.button:hover {{
-                background: #333;
-                color: #fff;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="wrapper">
-            <img src='https://cdn.sumup.store/shops/06666267/settings/th480/b23c5cae-b59a-41f7-a55e-1b145f750153.png' alt='Logo'>
-            <h1>Thank you for your order!</h1>
-            <p>Your payment was successful and your print order for roll <strong>{sticker}</strong> has been received.</p>
-            <p>You’ll receive a confirmation email shortly at <strong>{email}</strong>.</p>
-            <a class="button" href='/roll/{sticker}'>← Back to Gallery</a>
-        </div>
-    </body>
-    </html>
-    """)
+    return render_template(TEMPLATES["thank_you"], sticker=sticker, email=email)
 
 @app.route('/mollie-webhook', methods=['POST'])
 def mollie_webhook():
-    mollie_api_key = os.getenv("MOLLIE_API_KEY")
-    if not mollie_api_key:
+    if get_payment_gateway() is None:
         return "API key missing", 500
 
-    from mollie.api.client import Client as MollieClient
-    from urllib.parse import urlparse, unquote
-    mollie_client = MollieClient()
-    mollie_client.set_api_key(mollie_api_key)
-
     payment_id = request.form.get("id")
     if not payment_id:
         return "Missing payment ID", 400
 
-    try:
-        payment = mollie_client.payments.get(payment_id)
-        if not payment.is_paid():
-            return "Payment not completed", 200
-
-        airtable_url = f"https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_TABLE_NAME}"
-        headers = {"Authorization": f"Bearer {AIRTABLE_API_KEY}"}
-        formula = f"{{Mollie ID}}='{payment_id}'"
-        response = requests.get(airtable_url, headers=headers, params={"filterByFormula": formula})
-        records = response.json().get("records", [])
-        if not records:
-            return "Order not found", 404
-
-        record = records[0]
-        fields = record["fields"]
-        sticker = fields.get("Twin Sticker")
-        client_email = fields.get("Client Email")
-        client_name = fields.get("Client Name", "Client")
-        submitted_order = json.loads(fields.get("Print Order JSON", "[]"))
-
-        # Mark as Paid
-        update_url = f"https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_TABLE_NAME}/{record['id']}"
-        update_response = requests.patch(update_url, headers=headers, json={"fields": {"Print Order Paid": True}})
-
-        # Calculate pricing breakdown
-        type_counter = {}
-        subtotal = 0.0
-        count_10x15 = 0
-        tax_rate = 0.21
-
-        for item in submitted_order:
-            size = item['size']
-            paper = item['paper']
-            price = 0.0
-            if size == '10x15':
-                price = 0.75
-                count_10x15 += 1
-            elif size == 'A6': price = 1.5
-            elif size == 'A5': price = 3.0
-            elif size == 'A4': price = 6.0
-            elif size == 'A3': price = 12.0
-
-            key = f"{size} - {paper}"
-            type_counter[key] = type_counter.get(key, 0) + 1
-            subtotal += price
-
-        if count_10x15 >= 20:
-            subtotal = min(subtotal, 15.0)
-
-        tax = subtotal * tax_rate / (1 + tax_rate)
-        total = subtotal
-
-        # Compose customer email
-        email_body = f"""
-        <div style='text-align: center;'>
-          <img src='https://cdn.sumup.store/shops/06666267/settings/th480/b23c5cae-b59a-41f7-a55e-1b145f750153.png' style='max-width: 200px; margin-bottom: 20px;'>
-        </div>
-        <div style='font-family: Helvetica, sans-serif; font-size: 16px;'>
-        <p>Hi there,</p>
-        <p>Thank you for your print order. Here’s a summary of what you selected for roll <strong>{sticker}</strong>:</p>
-        <ul>
-        """
-        for item in submitted_order:
-            email_body += f"<li><img src='{item['url']}' width='100'><br>{item['size']} – {item['paper']}, Include Scan Border: {item['border']}</li>"
-        email_body += "</ul>"
-        email_body += f"<p><strong>Delivery Method:</strong> {fields.get('Delivery Method', 'N/A')}</p>"
-        email_body += "<p><strong>Order Breakdown:</strong></p><ul>"
-        for type, count in type_counter.items():
-            email_body += f"<li>{count} × {type}</li>"
-        email_body += f"</ul><p>Subtotal (excl. VAT): €{subtotal - tax:.2f}<br>VAT (21%): €{tax:.2f}<br><strong>Total: €{total:.2f}</strong></p>"
-        email_body += "<p>The order was successfully paid through Mollie.</p><p>We’ll start printing soon!<br>We'll notify you when your prints are ready for pickup at the lab or your drop-off point.</p></div>"
-
-        msg = EmailMessage()
-        msg["From"] = "Gil Plaquet FilmLab <filmlab@gilplaquet.com>"
-        msg["To"] = client_email
-        msg["Bcc"] = "filmlab@gilplaquet.com"
-        msg["Subject"] = f"Print Order Confirmation – Roll {sticker}"
-        msg.set_content("Your order is confirmed.")
-        msg.add_alternative(f"<html><body>{email_body}</body></html>", subtype="html")
-
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASS)
-            server.send_message(msg)
-
-        # Internal notification email
-        internal_msg = EmailMessage()
-        internal_msg["From"] = "Gil Plaquet FilmLab <filmlab@gilplaquet.com>"
-        internal_msg["To"] = "filmlab@gilplaquet.com"
-        internal_msg["Subject"] = f"A new print order for roll {sticker}"
-
-        internal_body = f"<h3>Roll {sticker} – Print Order Summary</h3><ul>"
-        for item in submitted_order:
-            parsed_url = urlparse(item['url'])
-            filename = unquote(parsed_url.path.split("/")[-1].split("?")[0])
-            internal_body += (
-                f"<li><strong>{filename}</strong><br>"
-                f"{item['size']} – {item['paper']}, Border: {item['border']}<br>"
-                f"<img src='{item['url']}' width='100'></li>"
-            )
-        internal_body += "</ul>"
-
-        internal_msg.set_content("New print order received.")
-        internal_msg.add_alternative(f"<html><body>{internal_body}</body></html>", subtype="html")
-
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASS)
-            server.send_message(internal_msg)
-
-        return "OK", 200
-
-    except Exception as e:
-        return f"Webhook error: {e}", 500
+    if state_store.payment_done(payment_id, "paid"):
+        return "Already processed", 200
+    # Recorded before the 200 so a restart can't lose it; if this fails,
+    # Mollie gets an error and delivers again.
+    state_store.queue_webhook(payment_id)
+    webhook_queue.enqueue(payment_id)
+    return "OK", 200
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("serve", help="run the web app (default)")
+    backfill = commands.add_parser("backfill-manifests", help="write manifest.json for existing rolls")
+    backfill.add_argument("folders", nargs="*", help="roll folders (default: all)")
+    backfill.add_argument("--force", action="store_true", help="rewrite manifests that already exist")
+    args = parser.parse_args()
+
+    if args.command == "backfill-manifests":
+        backfill_manifests(args.folders, force=args.force)
+    else:
+        get_s3_client()
+        webhook_queue.start()
+        app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
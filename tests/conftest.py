@@ -0,0 +1,75 @@
+import json
+import os
+import re
+import sys
+from datetime import datetime
+
+import pytest
+
+# The app reads its configuration at import time. Keep it offline: the fake
+# payment gateway, and the text-file state store, which only writes when a
+# roll is emailed.
+os.environ.setdefault("PAYMENT_GATEWAY", "fake")
+os.environ.setdefault("STATE_BACKEND", "file")
+os.environ.setdefault("B2_BUCKET_NAME", "test-bucket")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import drive_airtable_email as app_module  # noqa: E402
+from drive_airtable_email import RollFrameIndex, TokenBucket  # noqa: E402
+
+STICKER = "1234"
+FOLDER = "2024_001234"
+FRAME_COUNT = 40
+PASSWORD = "secret12"
+
+
+class FakeResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self._data = data
+        self.text = json.dumps(data)
+
+    def json(self):
+        return self._data
+
+
+class FakeAirtable:
+    # Answers AirtableClient's session calls for one Rolls record.
+    def __init__(self, record):
+        self.record = record
+
+    def request(self, method, url, params=None, json=None, **kwargs):
+        fields = self.record["fields"]
+        if method == "PATCH":
+            fields.update(json["fields"])
+            return FakeResponse(200, self.record)
+        if url.endswith("/" + self.record["id"]):
+            return FakeResponse(200, self.record)
+        matches = re.findall(r"\{([^}]+)\}='([^']*)'", (params or {}).get("filterByFormula", ""))
+        found = any(str(fields.get(field)) == value for field, value in matches)
+        return FakeResponse(200, {"records": [self.record] if found else []})
+
+
+@pytest.fixture(scope="module")
+def shop():
+    # One roll of FRAME_COUNT frames behind fake Airtable, bucket and mail.
+    # Yields (record, sent messages, test client logged in to the roll).
+    record = {"id": "recRoll", "fields": {
+        "Twin Sticker": STICKER, "Client Email": "client@example.com", "Scan": "Hires", "Size": "35mm",
+        "Password": PASSWORD, "Password Updated": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+    }}
+    frames = RollFrameIndex([f"rolls/{FOLDER}/IMG_{i}.jpg" for i in range(1, FRAME_COUNT + 1)], set())
+    sent = []
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(app_module.airtable.session, "request", FakeAirtable(record).request)
+        mp.setattr(app_module.airtable, "limiter", TokenBucket(rate=1e9))
+        mp.setattr(app_module.roll_folder_index, "lookup", lambda sticker: FOLDER)
+        mp.setattr(app_module, "load_roll_frames", lambda folder: frames)
+        mp.setattr(app_module, "generate_signed_url", lambda key, expires_in=604800: f"https://signed.example/{key}")
+        mp.setattr(app_module.mail_queue, "enqueue", sent.append)
+        app_module.app.config["TESTING"] = True
+        client = app_module.app.test_client()
+        with client.session_transaction() as session:
+            session[f"access_{STICKER}"] = PASSWORD
+        yield record, sent, client
@@ -0,0 +1,30 @@
+"""The order steps sign URLs for the frames posted to them, so they need the
+same password access as the gallery."""
+import pytest
+
+import drive_airtable_email as app_module
+from conftest import STICKER
+
+ORDER = {"order[0][frame]": "IMG_1.jpg", "order[0][size]": "10x15", "order[0][paper]": "Glossy", "order[0][border]": "No"}
+
+
+@pytest.mark.parametrize("step, form", [
+    ("submit-order", {"selected_images": "IMG_1.jpg"}),
+    ("submit-order", ORDER),
+    ("review-order", ORDER),
+    ("finalize-order", ORDER),
+])
+def test_order_steps_need_roll_access(shop, step, form):
+    record, _, _ = shop
+    stranger = app_module.app.test_client()
+    response = stranger.post(f"/roll/{STICKER}/{step}", data=form)
+    assert response.status_code == 403
+    assert "signed.example" not in response.get_data(as_text=True)
+    assert "Mollie ID" not in record["fields"]
+
+
+def test_order_steps_open_with_roll_access(shop):
+    _, _, client = shop
+    response = client.post(f"/roll/{STICKER}/submit-order", data={"selected_images": "IMG_1.jpg"})
+    assert response.status_code == 200
+    assert "signed.example/rolls/" in response.get_data(as_text=True)
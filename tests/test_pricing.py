@@ -0,0 +1,125 @@
+"""The four places an order gets priced must agree with order_total():
+the confirm page's JS, review_order, the amount finalize_order charges, and
+the confirmation email sent from the webhook."""
+import json
+import math
+import re
+import shutil
+import subprocess
+
+import pytest
+from hypothesis import given, settings, strategies as st
+
+import drive_airtable_email as app_module
+from conftest import FRAME_COUNT, STICKER
+from drive_airtable_email import PRICE_CAPS, PRINT_PRICES, order_total, price_order
+
+TOTAL_RE = re.compile(r"Total: €(\d+\.\d\d)")
+
+sizes = st.sampled_from(sorted(PRINT_PRICES))
+roll_sizes = st.sampled_from(sorted(PRICE_CAPS) + ["120", ""])
+
+
+def near_cap(roll_size):
+    # Orders of only the capped size, sized around the minimum print count
+    # and around the count where the cap starts to bite.
+    cap = PRICE_CAPS[roll_size]
+    biting = math.ceil(cap["cap"] / PRINT_PRICES[cap["size"]])
+    counts = [n for n in range(cap["min_prints"] - 1, cap["min_prints"] + 2) if 0 < n <= FRAME_COUNT]
+    counts += [n for n in (biting - 1, biting) if 0 < n <= FRAME_COUNT]
+    mixed = st.builds(lambda n, size: [cap["size"]] * (n - 1) + [size], st.sampled_from(counts), sizes)
+    return st.tuples(st.one_of(st.sampled_from(counts).map(lambda n: [cap["size"]] * n), mixed), st.just(roll_size))
+
+
+# (sizes of the prints, roll film size). Plain lists rarely land on a cap's
+# edges, so those are drawn on purpose too.
+cases = st.one_of(
+    st.tuples(st.lists(sizes, min_size=1, max_size=FRAME_COUNT), roll_sizes),
+    st.sampled_from(sorted(PRICE_CAPS)).flatmap(near_cap),
+)
+papers = st.sampled_from(["Glossy", "Matte", "Luster"])
+
+
+def order_form(order, draw_papers=None):
+    form = {}
+    for i, size in enumerate(order):
+        form[f"order[{i}][frame]"] = f"IMG_{i + 1}.jpg"
+        form[f"order[{i}][size]"] = size
+        form[f"order[{i}][paper]"] = draw_papers[i] if draw_papers else "Glossy"
+        form[f"order[{i}][border]"] = "No"
+    return form
+
+
+@given(case=cases)
+def test_price_order_matches_order_total(case):
+    order, roll_size = case
+    items = [{"frame": f"IMG_{i}.jpg", "size": size, "paper": "Glossy", "border": "No"} for i, size in enumerate(order)]
+    priced, type_counter, total = price_order(items, roll_size)
+    list_total = sum(item["price"] for item in priced)
+    assert total == order_total(order, roll_size)
+    assert sum(type_counter.values()) == len(order)
+    assert total <= list_total + 1e-9
+    cap = PRICE_CAPS.get(roll_size)
+    if cap and set(order) == {cap["size"]} and len(order) >= cap["min_prints"]:
+        assert total <= cap["cap"] + 1e-9
+    else:
+        assert total == pytest.approx(list_total)
+
+
+@settings(max_examples=60, deadline=None)
+@given(case=cases, data=st.data())
+def test_review_payment_and_webhook_match_order_total(shop, case, data):
+    order, roll_size = case
+    record, sent, client = shop
+    record["fields"]["Size"] = roll_size
+    app_module.airtable_record_cache.invalidate_record(record["id"])
+    form = order_form(order, data.draw(st.lists(papers, min_size=len(order), max_size=len(order))))
+    expected = order_total(order, roll_size)
+
+    review = client.post(f"/roll/{STICKER}/review-order", data=form)
+    assert review.status_code == 200
+    assert TOTAL_RE.search(review.get_data(as_text=True)).group(1) == f"{expected:.2f}"
+
+    finalize = client.post(f"/roll/{STICKER}/finalize-order", data=form)
+    assert finalize.status_code == 302
+    payment_id = record["fields"]["Mollie ID"]
+    assert app_module.get_payment_gateway().get_payment(payment_id).amount == pytest.approx(expected)
+
+    del sent[:]
+    assert client.post("/mollie-webhook", data={"id": payment_id}).status_code == 200
+    app_module.webhook_queue.drain()
+    customer_email = next(msg for msg in sent if msg["To"] == "client@example.com")
+    html = customer_email.get_body(("html",)).get_content()
+    assert TOTAL_RE.search(html).group(1) == f"{expected:.2f}"
+
+
+CONFIRM_PAGE_DOM = """
+const rows = SIZES.map(size => ({
+  querySelector: selector => ({value: selector === '.size' ? size : '', textContent: ''}),
+  querySelectorAll: () => [],
+}));
+const display = {textContent: ''};
+const document = {
+  querySelectorAll: selector => selector === '[data-row]' ? rows : [],
+  getElementById: id => id === 'totalDisplay' ? display : {value: '—'},
+  addEventListener: () => {},
+};
+"""
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node to run the confirm page's script")
+@settings(max_examples=40, deadline=None)
+@given(case=cases)
+def test_confirm_page_total_matches_order_total(shop, case):
+    order, roll_size = case
+    record, _, client = shop
+    record["fields"]["Size"] = roll_size
+    app_module.airtable_record_cache.invalidate_record(record["id"])
+
+    page = client.post(f"/roll/{STICKER}/submit-order", data=order_form(order))
+    assert page.status_code == 200
+    scripts = re.findall(r"<script>(.*?)</script>", page.get_data(as_text=True), re.S)
+    source = (f"const SIZES = {json.dumps(order)};\n" + CONFIRM_PAGE_DOM + "\n".join(scripts)
+              + "\nupdateTotal();\nconsole.log(display.textContent);")
+    shown = subprocess.run(["node", "-e", source], capture_output=True, text=True, check=True).stdout
+    assert shown.strip() == f"Your order total is €{order_total(order, roll_size):.2f}"